@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+
+# Annualization factor assuming 252 trading days in a year
+annualization_factor = 252
+
+# Windows, in trading days, of the rolling Sharpe ratios
+rolling_windows = [63, 252]
+
+
+# Money curves side by side: column c holds curve c's rows in date order, padded with NaN.
+# Curves are aligned by their own rows rather than by calendar date, so every return is taken
+# between consecutive rows of one curve, exactly as pct_change does on that curve alone.
+class CurveMatrix:
+    def __init__(self, names, dates, money, traded, counts):
+        self.names = names      # Curve labels, one per column
+        self.dates = dates      # Date of each row, NaT past the end of the curve
+        self.money = money
+        self.traded = traded    # Money put into trades on each row, NaN when the curve does not record it
+        self.counts = counts    # Rows in each curve
+
+    @property
+    def returns(self):
+        returns = np.full(self.money.shape, np.nan)
+        returns[1:] = self.money[1:] / self.money[:-1] - 1
+        return returns
+
+    # Years between each curve's first and last date
+    @property
+    def years(self):
+        columns = np.arange(len(self.names))
+        return (self.dates[self.counts - 1, columns] - self.dates[0]) / np.timedelta64(1, 'D') / 365.25
+
+
+# Long-format curves (Date, Money, Strategy and optionally Traded) into one CurveMatrix.
+# Every curve label in 'Strategy' becomes one column.
+def curve_matrix(data):
+    codes, names = pd.factorize(data['Strategy'])
+    positions = data.groupby(codes, sort=False).cumcount().to_numpy()
+    counts = np.bincount(codes, minlength=len(names))
+    shape = (counts.max() if len(counts) else 0, len(names))
+
+    dates = np.full(shape, np.datetime64('NaT'), dtype='datetime64[ns]')
+    dates[positions, codes] = pd.to_datetime(data['Date']).to_numpy()
+    money = np.full(shape, np.nan)
+    money[positions, codes] = data['Money'].to_numpy(dtype=float)
+    traded = np.full(shape, np.nan)
+    if 'Traded' in data:
+        traded[positions, codes] = data['Traded'].to_numpy(dtype=float)
+
+    return CurveMatrix(np.asarray(names), dates, money, traded, counts)
+
+
+# Length, in rows, of the longest stretch each curve spends below its previous peak
+def drawdown_duration(money, peak):
+    rows = np.arange(money.shape[0])[:, None]
+    last_peak_row = np.maximum.accumulate(np.where(money >= peak, rows, 0), axis=0)
+    return np.where(np.isnan(money), 0, rows - last_peak_row).max(axis=0, initial=0)
+
+
+# Every metric of every curve of a CurveMatrix, one row per curve
+def curve_metrics(curves):
+    money = curves.money
+    returns = curves.returns
+    columns = np.arange(len(curves.names))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Calculate annualized return (CAGR)
+        total_return = money[curves.counts - 1, columns] / money[0] - 1
+        annualized_return = (1 + total_return) ** (1 / curves.years) - 1
+
+        # Calculate annualized volatility, and the downside deviation that counts only losing days
+        annualized_volatility = np.nanstd(returns, axis=0, ddof=1) * np.sqrt(annualization_factor)
+        downside_deviation = np.sqrt(np.nanmean(np.minimum(returns, 0) ** 2, axis=0)) * np.sqrt(annualization_factor)
+
+        # Drawdowns from the running peak
+        peak = np.fmax.accumulate(money, axis=0)
+        max_drawdown = np.nanmin(money / peak - 1, axis=0)
+
+        # Ratios (assuming risk-free rate of 0); NaN where the denominator is 0
+        sharpe_ratio = np.where(annualized_volatility != 0, annualized_return / annualized_volatility, np.nan)
+        sortino_ratio = np.where(downside_deviation != 0, annualized_return / downside_deviation, np.nan)
+        calmar_ratio = np.where(max_drawdown != 0, annualized_return / np.abs(max_drawdown), np.nan)
+
+        # Share of the days with a gain or a loss that were gains
+        hit_rate = (returns > 0).sum(axis=0) / ((returns != 0) & ~np.isnan(returns)).sum(axis=0)
+
+        # Money put into trades per year, relative to the average money; NaN for curves without a Traded column
+        has_traded = ~np.isnan(curves.traded).all(axis=0)
+        turnover = np.where(has_traded, np.nansum(curves.traded, axis=0) / np.nanmean(money, axis=0) / curves.years, np.nan)
+
+    return pd.DataFrame({
+        'CAGR': annualized_return,
+        'Annualized Volatility': annualized_volatility,
+        'Sharpe Ratio': sharpe_ratio,
+        'Sortino Ratio': sortino_ratio,
+        'Max Drawdown': max_drawdown,
+        'Max Drawdown Duration': drawdown_duration(money, peak),
+        'Calmar Ratio': calmar_ratio,
+        'Hit Rate': hit_rate,
+        'Turnover': turnover,
+    }, index=pd.Index(curves.names, name='Strategy'))
+
+
+# Every metric of every curve of long-format data, one row per curve
+def performance_metrics(data):
+    return curve_metrics(curve_matrix(data))
+
+
+# Annualized Sharpe ratio of the last 'window' daily returns of every curve on every row, from running sums
+def rolling_sharpe_matrix(returns, window):
+    observed = ~np.isnan(returns)
+    values = np.where(observed, returns, 0)
+
+    # Window sums are differences of running sums, so each window costs the same whatever its length
+    def window_sums(x):
+        running = np.vstack([np.zeros((1, x.shape[1])), np.cumsum(x, axis=0)])
+        return running[window:] - running[:-window]
+
+    sharpe = np.full(returns.shape, np.nan)
+    if len(returns) < window:
+        return sharpe
+
+    count, total, square_total = window_sums(observed), window_sums(values), window_sums(values ** 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / window
+        variance = np.maximum(square_total - total * mean, 0) / (window - 1)
+        sharpe[window - 1:] = np.where((count == window) & (variance > 0),
+                                       mean / np.sqrt(variance) * np.sqrt(annualization_factor), np.nan)
+    return sharpe
+
+
+# Rolling Sharpe ratios of every curve in long format: Date, Strategy and one column per window
+def rolling_sharpe(data, windows=rolling_windows):
+    curves = curve_matrix(data)
+    returns = curves.returns
+
+    # Every row of every curve, curve by curve
+    columns, rows = np.nonzero(~np.isnan(curves.money).T)
+
+    frame = pd.DataFrame({'Date': curves.dates[rows, columns], 'Strategy': curves.names[columns]})
+    for window in windows:
+        frame[f'Rolling Sharpe {window}d'] = rolling_sharpe_matrix(returns, window)[rows, columns]
+    return frame
@@ -0,0 +1,265 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import math
+import os
+import shutil
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import FindDailyReturns
+import GraphBuilder
+import PerformanceAnalyzer
+from Portfolio import simulate_portfolio
+from PriceData import Dataset, day_ordinals, load_price_frame
+from ResultsStore import save_strategy_results
+from StockDataFetcher import SyntheticSource, synthetic_constituents
+
+# Dataset sizes (symbols x days) measured by default, from DJIA-sized to a wide universe
+default_sizes = '30x1260,100x2520,500x5040'
+default_portfolio_size = '10000x7560'  # 10,000 symbols over 30 years
+default_missing_rate = 0.01
+benchmark_dir = 'benchmark_data'
+baseline_file = 'benchmark_baseline.json'
+
+# Strategy modules timed, in pipeline order
+strategy_modules = ['WorstPerDaySim', 'BuyAndHold', 'MeanReversion', 'Reversal']
+
+# A stage this much slower than the baseline, and by more than the noise of a short stage, is reported as a regression
+regression_ratio = 1.25
+regression_seconds = 0.02
+
+
+# Write a seeded synthetic dataset in the djia_all_data.csv schema (the same columns StockDataFetcher writes)
+def write_synthetic_data(path, num_symbols, num_days, missing_rate=default_missing_rate, seed=0):
+    source = SyntheticSource(seed, num_days, missing_rate)
+    frames = []
+    constituents = synthetic_constituents(num_symbols)
+    for symbol, company in zip(constituents['Symbol'], constituents['Company']):
+        stock_data = source.download(symbol, source.dates[0], source.dates[-1] + pd.Timedelta(days=1))
+        stock_data['Date'] = stock_data.index
+        stock_data['Company'] = company
+        stock_data['Symbol'] = symbol
+        frames.append(stock_data)
+
+    pd.concat(frames, ignore_index=True).to_csv(path, index=False, date_format='%Y-%m-%d')
+
+
+# Directory of one dataset size, generating its CSV on first use
+def prepare_dataset(num_symbols, num_days, missing_rate, seed, directory=benchmark_dir):
+    size_dir = os.path.join(directory, f"{num_symbols}x{num_days}_missing{missing_rate}_seed{seed}")
+    csv_file = os.path.join(size_dir, 'djia_all_data.csv')
+    if not os.path.isfile(csv_file):
+        os.makedirs(size_dir, exist_ok=True)
+        write_synthetic_data(csv_file, num_symbols, num_days, missing_rate, seed)
+    return size_dir
+
+
+# Best wall time over 'repeat' runs, and the peak memory allocated by one further traced run.
+# 'setup' runs before every call and is not measured.
+def measure(stage, repeat, setup=None):
+    best = math.inf
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        stage()
+        best = min(best, time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        stage()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': best, 'peak_mb': peak / 2 ** 20}
+
+
+# Time every pipeline stage on one dataset: cold load from the CSV, returns, each strategy, analysis and plotting
+def benchmark_size(size_dir, repeat):
+    cache_dir = os.path.join(size_dir, 'cache')
+    results_dir = os.path.join(size_dir, 'results')
+    dataset = Dataset(os.path.join(size_dir, 'djia_all_data.csv'), os.path.join(size_dir, 'djia_daily_returns.csv'), cache_dir)
+
+    def cold_start():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        dataset.reload()
+
+    # Strategies start from the loaded price and returns stores but compute their own indicators
+    def warm_start():
+        dataset.reload()
+        dataset.panel
+        dataset.returns
+
+    stages = {}
+    stages['load'] = measure(lambda: dataset.panel, repeat, cold_start)
+    stages['returns'] = measure(lambda: FindDailyReturns.run(dataset, write_csv=False), repeat)
+
+    shutil.rmtree(results_dir, ignore_errors=True)
+    run_ids = []
+    for module_name in strategy_modules:
+        strategy = importlib.import_module(module_name)
+        stages[module_name] = measure(lambda: strategy.run(dataset), repeat, warm_start)
+        run_ids.append(save_strategy_results(strategy.run(dataset), strategy.strategy_name, directory=results_dir))
+
+    # The analysis stages read the results store from the working directory
+    working_dir = os.getcwd()
+    os.chdir(size_dir)
+    try:
+        stages['analysis'] = measure(lambda: PerformanceAnalyzer.run(dataset, run_ids=run_ids), repeat)
+        stages['plotting'] = measure(lambda: GraphBuilder.run(dataset, run_ids=run_ids, show=False), repeat)
+    finally:
+        os.chdir(working_dir)
+    return stages
+
+
+# Memory of the price CSV held the old way (every column, object strings and datetime.date objects) against the
+# compact loader (projected columns, categorical symbols, int32 day ordinals, float32 prices), and the time
+# to select the rows of a sample of dates in each
+def loader_comparison(size_dir, sample_dates=50):
+    csv_file = os.path.join(size_dir, 'djia_all_data.csv')
+    full = pd.read_csv(csv_file)
+    full['Date'] = pd.to_datetime(full['Date']).dt.date
+    compact = load_price_frame(csv_file, ['Adj Close'], np.float32)
+
+    dates = full['Date'].drop_duplicates().to_numpy()
+    sample = dates[np.linspace(0, len(dates) - 1, sample_dates).astype(int)]
+    ordinals = day_ordinals(pd.to_datetime(pd.Series(sample)))
+
+    def select(frame, keys):
+        for key in keys:
+            frame[frame['Date'] == key]
+
+    full_time = measure(lambda: select(full, sample), 3)['seconds']
+    compact_time = measure(lambda: select(compact, ordinals), 3)['seconds']
+    return {'full_mb': full.memory_usage(deep=True).sum() / 2 ** 20,
+            'compact_mb': compact.memory_usage(deep=True).sum() / 2 ** 20,
+            'full_seconds': full_time, 'compact_seconds': compact_time}
+
+
+# Time the portfolio engine on random returns and holdings of num_symbols stocks over num_days, rebalanced
+# every 'rebalance_every' days. The panels are generated in memory: a CSV of this size is not needed to value them.
+def portfolio_benchmark(num_symbols, num_days, rebalance_every=(1, 5, 21), seed=0, repeat=1):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0003, 0.02, (num_days, num_symbols))
+    weights = rng.random((num_days, num_symbols))
+    weights /= weights.sum(axis=1, keepdims=True)
+    dates = pd.bdate_range('1990-01-01', periods=num_days)
+
+    results = {}
+    for every in rebalance_every:
+        rebalance_rows = np.arange(0, num_days, every)
+        results[every] = measure(lambda: simulate_portfolio(dates, weights, returns, 100000, rebalance_rows, 5, 5), repeat)
+    return results
+
+
+def run_benchmarks(sizes, missing_rate=default_missing_rate, seed=0, repeat=3, directory=benchmark_dir):
+    results = {}
+    for num_symbols, num_days in sizes:
+        label = f"{num_symbols}x{num_days}"
+        print(f"Benchmarking {label}...")
+        size_dir = prepare_dataset(num_symbols, num_days, missing_rate, seed, directory)
+
+        # The stages' progress lines are not part of the measurement
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[label] = benchmark_size(size_dir, repeat)
+    return results
+
+
+# How each stage's time grows with the number of (date, symbol) cells, as the exponent of a power law
+# fitted between the smallest and largest size (1.0 is linear)
+def scaling_exponents(results):
+    labels = sorted(results, key=lambda label: math.prod(int(part) for part in label.split('x')))
+    cells = [math.prod(int(part) for part in label.split('x')) for label in labels]
+    if len(labels) < 2 or cells[0] == cells[-1]:
+        return {}
+
+    exponents = {}
+    for stage in results[labels[0]]:
+        first, last = results[labels[0]][stage]['seconds'], results[labels[-1]][stage]['seconds']
+        exponents[stage] = math.log(last / first) / math.log(cells[-1] / cells[0]) if first > 0 and last > 0 else math.nan
+    return exponents
+
+
+def print_report(results, baseline=None):
+    labels = list(results)
+    stages = list(results[labels[0]])
+
+    print(f"{'Stage':<16}" + ''.join(f"{label + ' (s)':>16}{'MB':>8}" for label in labels) + f"{'Scaling':>9}")
+    exponents = scaling_exponents(results)
+    for stage in stages:
+        row = f"{stage:<16}"
+        for label in labels:
+            row += f"{results[label][stage]['seconds']:>16.3f}{results[label][stage]['peak_mb']:>8.1f}"
+        print(row + f"{exponents.get(stage, math.nan):>9.2f}")
+
+    if baseline is None:
+        return
+
+    print(f"\nAgainst the baseline (time ratio; above {regression_ratio:.2f} and {regression_seconds}s slower is flagged):")
+    for label in labels:
+        for stage in stages:
+            previous = baseline.get(label, {}).get(stage)
+            if previous is None:
+                continue
+            ratio = results[label][stage]['seconds'] / previous['seconds'] if previous['seconds'] > 0 else math.nan
+            slower = results[label][stage]['seconds'] - previous['seconds'] > regression_seconds
+            flag = '  REGRESSION' if ratio > regression_ratio and slower else ''
+            print(f"{label:>12} {stage:<16} {previous['seconds']:>9.3f}s -> {results[label][stage]['seconds']:>9.3f}s "
+                  f"{ratio:>6.2f}x{flag}")
+
+
+# Parse "30x1260,500x5040" into [(30, 1260), (500, 5040)]
+def parse_sizes(text):
+    return [tuple(int(part) for part in size.split('x')) for size in text.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on seeded synthetic datasets, fully offline.")
+    parser.add_argument('--sizes', default=default_sizes, help="Comma-separated SYMBOLSxDAYS dataset sizes")
+    parser.add_argument('--missing-rate', type=float, default=default_missing_rate, help="Share of rows missing from each history")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage; the best is kept")
+    parser.add_argument('--data-dir', default=benchmark_dir, help="Where the generated datasets are kept between runs")
+    parser.add_argument('--baseline', default=baseline_file, help="Stored results to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--loader', action='store_true', help="Also compare the memory and date lookups of the compact price loader")
+    parser.add_argument('--portfolio', nargs='?', const=default_portfolio_size, metavar='SYMBOLSxDAYS',
+                        help=f"Also time the portfolio engine on random holdings of this size (default {default_portfolio_size})")
+    args = parser.parse_args()
+
+    results = run_benchmarks(parse_sizes(args.sizes), args.missing_rate, args.seed, args.repeat, args.data_dir)
+
+    baseline = None
+    if os.path.isfile(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to '{args.baseline}'.")
+    elif baseline is None:
+        print(f"No baseline at '{args.baseline}'; run with --save-baseline to store one.")
+
+    if args.loader:
+        print(f"\n{'Dataset':<12}{'Full MB':>10}{'Compact MB':>12}{'Saved':>8}{'Full lookup (s)':>17}{'Compact (s)':>13}{'Speed-up':>10}")
+        for num_symbols, num_days in parse_sizes(args.sizes):
+            size_dir = prepare_dataset(num_symbols, num_days, args.missing_rate, args.seed, args.data_dir)
+            loader = loader_comparison(size_dir)
+            print(f"{f'{num_symbols}x{num_days}':<12}{loader['full_mb']:>10.1f}{loader['compact_mb']:>12.1f}"
+                  f"{1 - loader['compact_mb'] / loader['full_mb']:>8.0%}{loader['full_seconds']:>17.4f}"
+                  f"{loader['compact_seconds']:>13.4f}{loader['full_seconds'] / loader['compact_seconds']:>9.0f}x")
+
+    if args.portfolio:
+        (num_symbols, num_days), = parse_sizes(args.portfolio)
+        print(f"\nPortfolio engine, {num_symbols} symbols x {num_days} days:")
+        print(f"{'Rebalancing':<20}{'Seconds':>10}{'MB':>10}")
+        for every, result in portfolio_benchmark(num_symbols, num_days).items():
+            print(f"{f'every {every} days':<20}{result['seconds']:>10.2f}{result['peak_mb']:>10.1f}")
@@ -0,0 +1,74 @@
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import StockDataFetcher
+
+
+# Local source that sleeps before each request to stand in for network latency
+class SlowLocalSource(StockDataFetcher.LocalFileSource):
+    def __init__(self, directory, latency):
+        super().__init__(directory)
+        self.latency = latency
+
+    def download(self, symbol, start, end):
+        time.sleep(self.latency)
+        return super().download(symbol, start, end)
+
+
+# Write one random-walk price file per symbol in the yfinance column layout
+def write_source_files(directory, num_symbols, num_days, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2015-01-01', periods=num_days)
+    symbols = [f"SYM{k:03d}" for k in range(num_symbols)]
+
+    for symbol in symbols:
+        prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, num_days)))
+        pd.DataFrame({
+            'Date': dates, 'Open': prices, 'High': prices, 'Low': prices,
+            'Close': prices, 'Adj Close': prices, 'Volume': 1000,
+        }).to_csv(os.path.join(directory, f"{symbol}.csv"), index=False)
+
+    return pd.DataFrame({'Symbol': symbols, 'Company': [f"{symbol} Inc" for symbol in symbols]})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure fetch throughput against a simulated slow data source.")
+    parser.add_argument('--symbols', type=int, default=30)
+    parser.add_argument('--days', type=int, default=2520)
+    parser.add_argument('--latency', type=float, default=0.25, help="Seconds each simulated download takes")
+    parser.add_argument('--workers', default='1,2,4,8,16', help="Comma-separated worker counts to compare")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_dir = os.path.join(work_dir, 'source')
+        os.makedirs(source_dir)
+        djia_df = write_source_files(source_dir, args.symbols, args.days)
+        source = SlowLocalSource(source_dir, args.latency)
+        end_date = '2100-01-01'
+
+        print(f"{args.symbols} symbols x {args.days} days, {args.latency:.2f}s simulated latency per download")
+        print(f"{'Workers':>8} {'Fetch (s)':>10} {'Symbols/s':>10} {'Speed-up':>9} {'Assemble (s)':>13}")
+
+        baseline = None
+        for workers in [int(value) for value in args.workers.split(',')]:
+            # Start every measurement from an empty data directory so each one is a full fetch
+            data_dir = os.path.join(work_dir, f"data_{workers}")
+
+            # The fetcher's per-symbol progress lines are not part of the measurement
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                StockDataFetcher.fetch_all(djia_df, source, '2015-01-01', end_date, data_dir, workers=workers)
+                fetch_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            StockDataFetcher.assemble_all_data(djia_df, '2015-01-01', data_dir, workers=workers)
+            assemble_seconds = time.perf_counter() - start
+
+            baseline = baseline or fetch_seconds
+            print(f"{workers:>8} {fetch_seconds:>10.2f} {args.symbols / fetch_seconds:>10.1f} "
+                  f"{baseline / fetch_seconds:>8.1f}x {assemble_seconds:>13.2f}")
@@ -1,87 +1,66 @@
-import pandas as pd
-import os
+import numpy as np
+from PriceData import Dataset
+from Strategy import Strategy
+from ResultsStore import run_parameters, save_strategy_results
 
-# Load the original stock data with adjusted close prices
-stock_data = pd.read_csv('djia_all_data.csv')
-stock_data['Date'] = pd.to_datetime(stock_data['Date']).dt.date  # Ensure 'Date' is in datetime format
+strategy_name = 'Buy-and-Hold'
 
 # Set initial money for equal investment strategy
 initial_money = 100000
-equal_investment_money = initial_money
 
-# Get unique symbols of all stocks in the dataset
-all_symbols = stock_data['Symbol'].unique()
 
-# Dictionary to track shares owned for each stock
-shares_owned = {}
-
-# Calculate the investment per stock
-investment_per_stock = equal_investment_money / len(all_symbols)
-
-# Get the list of all unique dates
-all_dates = sorted(stock_data['Date'].unique())
-
-# Start date (10 years ago)
-start_date = all_dates[0]
-
-# Invest equally in all stocks
-for symbol in all_symbols:
-    # Get the first available date for the stock
-    first_available_date = stock_data[stock_data['Symbol'] == symbol]['Date'].min()
-    first_day_price = stock_data[(stock_data['Date'] == first_available_date) & (stock_data['Symbol'] == symbol)]['Adj Close'].values
-
-    if first_day_price.size == 0:
-        print(f"Missing price data for {symbol} on its first available date. Skipping initial investment.")
-        continue
-
-    first_day_price = first_day_price[0]
-    num_shares = investment_per_stock / first_day_price
-    shares_owned[symbol] = num_shares
-
-# To store the money over time for buy-and-hold strategy
-money_over_time = [{'Date': start_date, 'Money': equal_investment_money, 'Strategy': 'Buy-and-Hold'}]
-
-# Calculate the value of the portfolio for each day
-for current_date in all_dates:
-    # Calculate the total value of the portfolio on the current date
-    total_value = 0
-    for symbol, shares in shares_owned.items():
-        # Get the current day's adjusted close price for each stock
-        current_day_price = stock_data[(stock_data['Date'] == current_date) & (stock_data['Symbol'] == symbol)]['Adj Close'].values
-        if current_day_price.size == 0:
-            print(f"Missing price data for {symbol} on {current_date}. Skipping value calculation for this stock.")
-            continue
-
-        current_day_price = current_day_price[0]
-        total_value += shares * current_day_price
-
-    # Update the total money
-    equal_investment_money = total_value
-
-    # Record the current money and date
-    money_over_time.append({'Date': current_date, 'Money': equal_investment_money, 'Strategy': 'Buy-and-Hold'})
-
-    # Print the money after each day's value update
-    print(f"Date: {current_date.strftime('%Y-%m-%d')}, Money: ${equal_investment_money:,.2f}")
-
-# Create a DataFrame to store the new Buy-and-Hold strategy results
-money_df = pd.DataFrame(money_over_time)
-
-# Check if the shared CSV file exists
-csv_file = 'strategy_comparison.csv'
-if os.path.isfile(csv_file):
-    # Load the existing CSV file
-    existing_data = pd.read_csv(csv_file)
-
-    # Remove any previous Buy-and-Hold strategy data
-    existing_data = existing_data[existing_data['Strategy'] != 'Buy-and-Hold']
-
-    # Append the new Buy-and-Hold strategy data to the existing data
-    combined_data = pd.concat([existing_data, money_df], ignore_index=True)
-else:
-    # If no file exists, use only the new Buy-and-Hold strategy data
-    combined_data = money_df
-
-# Save the updated data to the CSV file, overwriting only the relevant strategy section
-combined_data.to_csv(csv_file, index=False)
-print("Buy-and-Hold strategy results updated in 'strategy_comparison.csv'.")
+# Invest an equal share of the initial money in every stock on the first date it has a price and hold it, valued
+# at its last price on dates it has no row; a stock that delists is sold at its last price and held as cash from
+# then on
+class BuyAndHoldStrategy(Strategy):
+    name = strategy_name
+    sizing = 'equal_weight'
+    holding_period = None
+
+
+def run(dataset, initial_money=initial_money):
+    return BuyAndHoldStrategy().run(dataset, initial_money=initial_money)
+
+
+# Streaming version of run(): takes the bars one date at a time and yields (date, money, traded) for the start
+# and for each date, keeping only the shares owned of each stock and its last price. A stock is bought on its
+# first date with a row; until then its share of the money is held as cash.
+# 'state' is kept up to date with the state at the end of each bar; a snapshot's state resumes the stream after it.
+def stream(bars, initial_money=initial_money, state=None):
+    state = {} if state is None else state
+    shares_owned = state['shares_owned'].copy() if 'shares_owned' in state else None
+    owned = state['owned'].copy() if 'owned' in state else None
+    last_price = state['last_price'].copy() if 'last_price' in state else None
+    investment_per_stock = state.get('investment_per_stock')
+    cash = state.get('cash', 0.0)
+
+    for bar in bars:
+        if shares_owned is None:
+            shares_owned = np.zeros(len(bar.prices))
+            owned = np.zeros(len(bar.prices), dtype=bool)
+            last_price = np.zeros(len(bar.prices))
+            investment_per_stock = initial_money / len(bar.prices)
+            yield bar.date, initial_money, 0.0
+
+        # Invest in the stocks that have their first row today
+        bought = bar.valid & ~owned
+        shares_owned[bought] = investment_per_stock / bar.prices[bought]
+        owned |= bought
+        last_price[bar.valid] = bar.prices[bar.valid]
+
+        # Value the holdings at their last prices, with the shares of the stocks not bought yet as cash
+        value = shares_owned * last_price
+        uninvested_cash = (~owned).sum() * investment_per_stock
+        yield bar.date, value.sum() + uninvested_cash + cash, investment_per_stock * bought.sum()
+
+        # Stocks on their last row are sold at today's price and held as cash from tomorrow
+        cash += value[bar.last].sum()
+        shares_owned[bar.last] = 0.0
+        state.update(shares_owned=shares_owned, owned=owned, last_price=last_price,
+                     investment_per_stock=investment_per_stock, cash=cash)
+
+
+if __name__ == '__main__':
+    money_df = run(Dataset())
+    run_id = save_strategy_results(money_df, strategy_name, run_parameters(run))
+    print(f"Buy-and-Hold strategy results saved as run {run_id}.")
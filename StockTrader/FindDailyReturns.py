@@ -1,34 +1,37 @@
 import pandas as pd
+from PriceData import Dataset
+from Returns import compute_returns, write_returns
 
-# Load the cleaned data from CSV into the DataFrame
-data_filled = pd.read_csv('djia_all_data.csv')
-
-# Check if 'Date' column exists, and if not, identify the correct column name
-if 'Date' not in data_filled.columns:
-    print("The 'Date' column is missing. Check for an alternative column name or ensure the data source is correct.")
-else:
-    # Convert 'Date' to datetime if it exists
-    data_filled['Date'] = pd.to_datetime(data_filled['Date'])
-    print("Date column successfully converted to datetime.")
-
-# Function to calculate daily returns
-def calculate_daily_returns(df):
-    df['Daily Return'] = df['Adj Close'].pct_change()
-    return df
-
-# Check if 'Adj Close' column exists before proceeding
-if 'Adj Close' not in data_filled.columns:
-    print("The 'Adj Close' column is missing. Cannot calculate daily returns.")
-else:
-    # Group by 'Symbol' and apply the daily returns calculation
-    data_filled = data_filled.groupby('Symbol').apply(calculate_daily_returns)
-
-    # Drop the rows with NaN values in 'Daily Return' column which occur due to pct_change()
-    data_filled.dropna(subset=['Daily Return'], inplace=True)
-
-    # Display the DataFrame with daily returns calculated
-    data_filled.reset_index(drop=True, inplace=True)
-
-    # Save the DataFrame with daily returns to a new CSV file (overwrite the existing file)
-    data_filled.to_csv('djia_daily_returns.csv', index=False)
-    print("Daily returns saved to 'djia_daily_returns.csv'.")
+
+# Every row of the price CSV, with all of its columns, that has a daily return, and that return as a
+# 'Daily Return' column; ordered by symbol and then in file order, as the returns file has always been written
+def daily_returns_frame(price_csv_file, panel, daily_returns):
+    stock_data = pd.read_csv(price_csv_file, float_precision='round_trip').sort_values('Symbol', kind='stable')
+    stock_data['Date'] = pd.to_datetime(stock_data['Date'])
+
+    # Look each row's return up at its (date, symbol) position in the panel
+    rows = panel.dates.get_indexer(stock_data['Date'])
+    columns = pd.Index(panel.symbols).get_indexer(stock_data['Symbol'])
+    stock_data['Daily Return'] = daily_returns[rows, columns]
+    return stock_data.dropna(subset=['Daily Return']).reset_index(drop=True)
+
+
+def run(dataset, write_csv=True):
+    # Compute every return series for the whole panel in one vectorized pass
+    panel = dataset.panel
+    returns = compute_returns(panel.prices, panel.valid)
+
+    # Save the returns store, aligned to the price panel and keyed by date and symbol
+    write_returns(returns, dataset.price_csv_file, dataset.cache_dir, panel.prices.dtype)
+    dataset.reload()
+    print("Returns store refreshed.")
+
+    # Save the daily returns to a CSV file as well (overwrite the existing file)
+    if write_csv:
+        daily_returns_frame(dataset.price_csv_file, panel, returns['return_1d']).to_csv(dataset.returns_csv_file, index=False)
+        print(f"Daily returns saved to '{dataset.returns_csv_file}'.")
+    return returns
+
+
+if __name__ == '__main__':
+    run(Dataset())
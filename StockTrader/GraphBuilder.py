@@ -1,77 +1,192 @@
-import pandas as pd
+import argparse
+import os
+import numpy as np
 import plotly.graph_objs as go
+from plotly.colors import qualitative
 from plotly.subplots import make_subplots
+from PriceData import Dataset
+from Analytics import curve_matrix, rolling_sharpe_matrix, rolling_windows
+from ResultsStore import load_runs
 
-# Load the strategy comparison data
-data = pd.read_csv('strategy_comparison.csv')
-data['Date'] = pd.to_datetime(data['Date'])  # Ensure 'Date' is in datetime format
+# Points drawn per curve and panel, about one per horizontal pixel of the figure; longer curves are downsampled
+default_width = 1600
 
-# Get all unique strategies present in the data
-strategies = data['Strategy'].unique()
+# Window, in trading days, of the rolling Sharpe panel
+sharpe_window = rolling_windows[-1]
 
-# Initialize an empty dictionary to store data for each strategy
-strategy_data = {}
+# Formats exported without a browser; all but HTML need the kaleido package
+image_formats = ['.png', '.jpg', '.jpeg', '.webp', '.svg', '.pdf']
 
-# Loop through each strategy and extract its data
-for strategy in strategies:
-    strategy_data[strategy] = data[data['Strategy'] == strategy]
 
-# Create the figure
-fig = make_subplots()
+# Largest-Triangle-Three-Buckets downsampling (Steinarsson): keeps a curve's first and last points and, from
+# each of threshold - 2 equal buckets in between, the point forming the largest triangle with the point kept
+# from the previous bucket and the average of the next bucket, so peaks, troughs and the curve's shape survive.
+# 'series' is a list of (x, y) arrays; all curves are stepped through the buckets together, so the loop runs
+# once per bucket whatever the number of curves. Returns the indices of the kept points of each curve.
+def lttb(series, threshold):
+    selected = [np.arange(len(x)) for x, _ in series]
+    long_curves = [c for c, (x, _) in enumerate(series) if len(x) > threshold >= 3]
+    if not long_curves:
+        return selected
 
-# Add traces for each strategy dynamically
-for strategy, df in strategy_data.items():
-    trace = go.Scatter(
-        x=df['Date'],
-        y=df['Money'],
+    # The long curves end to end, with each curve's offset into the joined arrays
+    x = np.concatenate([series[c][0] for c in long_curves])
+    y = np.concatenate([series[c][1] for c in long_curves])
+    lengths = np.array([len(series[c][0]) for c in long_curves])
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    # Bucket b of a curve holds its rows edges[b] to edges[b + 1]; buckets are padded to the largest one
+    edges = (1 + (lengths[:, None] - 2) * np.arange(threshold - 1) / (threshold - 2)).astype(int)
+    sizes = np.diff(edges, axis=1)
+    slots = np.arange(sizes.max())
+    in_bucket = slots < sizes[:, :, None]
+    rows = offsets[:, None, None] + np.where(in_bucket, edges[:, :-1, None] + slots, 0)
+    bucket_x, bucket_y = x[rows], y[rows]
+
+    # Average of the bucket after each one; after the last bucket comes the curve's last point
+    last = offsets + lengths - 1
+    next_x = np.column_stack([(np.where(in_bucket, bucket_x, 0).sum(axis=2) / sizes)[:, 1:], x[last]])
+    next_y = np.column_stack([(np.where(in_bucket, bucket_y, 0).sum(axis=2) / sizes)[:, 1:], y[last]])
+
+    curves = np.arange(len(long_curves))
+    kept = offsets
+    chosen = np.empty((len(long_curves), threshold), dtype=int)
+    chosen[:, 0], chosen[:, -1] = 0, lengths - 1
+    for bucket in range(threshold - 2):
+        kept_x, kept_y = x[kept][:, None], y[kept][:, None]
+        area = np.abs((kept_x - next_x[:, [bucket]]) * (bucket_y[:, bucket] - kept_y)
+                      - (kept_x - bucket_x[:, bucket]) * (next_y[:, [bucket]] - kept_y))
+        kept = rows[curves, bucket, np.argmax(np.where(in_bucket[:, bucket], area, -1), axis=1)]
+        chosen[:, bucket + 1] = kept - offsets
+
+    for c, keep in zip(long_curves, chosen):
+        selected[c] = keep
+    return selected
+
+
+# Dates and values of every curve of one panel, without the undefined points and downsampled to 'width' points
+def downsample(curves, values, width):
+    series = []
+    for column in range(len(curves.names)):
+        dates, points = curves.dates[:curves.counts[column], column], values[:curves.counts[column], column]
+        defined = ~np.isnan(points)
+        series.append((dates[defined], points[defined]))
+
+    # Seconds since the epoch as x, so the areas are computed on moderate numbers
+    kept = lttb([(dates.astype('int64') / 1e9, points) for dates, points in series], width)
+    return [(dates[keep], points[keep]) for (dates, points), keep in zip(series, kept)]
+
+
+def save_figure(fig, output_file):
+    extension = os.path.splitext(output_file)[1].lower()
+    if extension in ['.html', '.htm']:
+        # Self-contained: plotly.js is embedded, so the file opens offline
+        fig.write_html(output_file, include_plotlyjs=True)
+    elif extension in image_formats:
+        try:
+            fig.write_image(output_file)
+        except (ImportError, ValueError) as e:
+            raise RuntimeError(f"Exporting '{output_file}' needs the kaleido package (pip install kaleido); export to .html instead.") from e
+    else:
+        raise ValueError(f"Unknown figure format '{extension}'; use .html or one of {', '.join(image_formats)}.")
+    print(f"Figure saved to '{output_file}'.")
+
+
+# Plot the latest run of each strategy, or only the given strategies or run ids, with drawdown and rolling
+# Sharpe panels below the money curves. Every curve is downsampled to about 'width' points per panel and drawn
+# with WebGL, so figures of many long curves stay small.
+def run(dataset, strategies=None, run_ids=None, show=True, output_file=None, width=default_width, panels=True):
+    # Load only the requested runs from the results store, and line the curves up once for every panel
+    data = load_runs(run_ids, strategies)
+    curves = curve_matrix(data)
+    money = curves.money
+    drawdown = money / np.fmax.accumulate(money, axis=0) - 1
+    rolling_sharpe = rolling_sharpe_matrix(curves.returns, sharpe_window)
+
+    # The panels drawn: the money curves, and optionally the drawdowns and rolling Sharpe ratios
+    panel_values = [money, drawdown, rolling_sharpe] if panels else [money]
+    hover_formats = ['$%{y:,.2f}', '%{y:.1%}', '%{y:.2f}']
+    fig = make_subplots(rows=len(panel_values), cols=1, shared_xaxes=True, vertical_spacing=0.04,
+                        row_heights=[0.6, 0.2, 0.2][:len(panel_values)])
+
+    # Downsample every panel's curves together, then add traces for each strategy dynamically;
+    # a strategy has the same color and legend entry in every panel
+    panel_points = [downsample(curves, values, width) for values in panel_values]
+    for column, strategy in enumerate(curves.names):
+        color = qualitative.Plotly[column % len(qualitative.Plotly)]
+        for row, (points, hover_format) in enumerate(zip(panel_points, hover_formats), start=1):
+            fig.add_trace(go.Scattergl(
+                x=points[column][0],
+                y=points[column][1],
+                mode='lines',
+                name=f'{strategy} Strategy',
+                legendgroup=strategy,
+                showlegend=row == 1,
+                line=dict(color=color),
+                hovertemplate=f'Date: %{{x|%Y-%m-%d}}<br>{hover_format}',
+            ), row=row, col=1)
+
+    # Find the maximum value reached by any strategy
+    max_value = np.nanmax(money)
+    first_date, last_date = data['Date'].min(), data['Date'].max()
+
+    # Add a horizontal line for the maximum value
+    max_value_line = go.Scattergl(
+        x=[first_date, last_date],
+        y=[max_value, max_value],
         mode='lines',
-        name=f'{strategy} Strategy',
-        hoverinfo='text',
-        text=[f'Date: {date}<br>Money: ${money:,.2f}' for date, money in zip(df['Date'], df['Money'])]
+        line=dict(color='orange', width=2, dash='dash'),
+        name=f'Max Value: ${max_value:,.2f}',
+        hoverinfo='skip'
     )
-    fig.add_trace(trace)
-
-# Find the maximum value reached by any strategy
-max_value = max([df['Money'].max() for df in strategy_data.values()])
-
-# Add a horizontal line for the maximum value
-max_value_line = go.Scatter(
-    x=[data['Date'].min(), data['Date'].max()],
-    y=[max_value, max_value],
-    mode='lines',
-    line=dict(color='orange', width=2, dash='dash'),
-    name=f'Max Value: ${max_value:,.2f}',
-    hoverinfo='skip'
-)
-fig.add_trace(max_value_line)
-
-# Add annotation for the maximum value line on the left side
-fig.add_annotation(
-    x=data['Date'].min(),
-    y=max_value,
-    xref='x',
-    yref='y',
-    text=f"Max Value: ${max_value:,.2f}",
-    showarrow=True,
-    arrowhead=2,
-    ax=50,  # Adjusted value to position annotation on the left side
-    ay=0,
-    bgcolor="yellow"
-)
-
-# Set the title and labels
-fig.update_layout(
-    title="Strategy Performance Over Time",
-    xaxis_title="Date",
-    yaxis_title="Total Money ($)",
-    xaxis=dict(showgrid=True),
-    yaxis=dict(showgrid=True),
-    hovermode="x unified",  # Show hover info for both lines on the same date
-    legend=dict(x=0, y=1.1, orientation="h"),
-)
-
-# Customize hover label appearance
-fig.update_traces(hoverlabel=dict(bgcolor="white", font_size=12, font_family="Rockwell"))
-
-# Show the interactive plot
-fig.show()
+    fig.add_trace(max_value_line, row=1, col=1)
+
+    # Add annotation for the maximum value line on the left side
+    fig.add_annotation(
+        x=first_date,
+        y=max_value,
+        xref='x',
+        yref='y',
+        text=f"Max Value: ${max_value:,.2f}",
+        showarrow=True,
+        arrowhead=2,
+        ax=50,  # Adjusted value to position annotation on the left side
+        ay=0,
+        bgcolor="yellow"
+    )
+
+    # Set the title and labels
+    fig.update_layout(
+        title="Strategy Performance Over Time",
+        hovermode="x unified",  # Show hover info for all lines on the same date
+        legend=dict(x=0, y=1.1, orientation="h"),
+    )
+    fig.update_xaxes(showgrid=True)
+    fig.update_xaxes(title_text="Date", row=len(panel_values), col=1)
+    fig.update_yaxes(showgrid=True)
+    for row, title in enumerate(["Total Money ($)", "Drawdown", f"Sharpe ({sharpe_window}d)"][:len(panel_values)], start=1):
+        fig.update_yaxes(title_text=title, row=row, col=1)
+
+    # Customize hover label appearance, once for the whole figure rather than trace by trace
+    fig.update_layout(hoverlabel=dict(bgcolor="white", font_size=12, font_family="Rockwell"))
+
+    # Save the figure without a browser, or show the interactive plot
+    if output_file:
+        save_figure(fig, output_file)
+    elif show:
+        fig.show()
+    return fig
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Plot the money curves of saved strategy runs.")
+    parser.add_argument('--strategies', help="Comma-separated strategy names; defaults to every strategy")
+    parser.add_argument('--runs', help="Comma-separated run ids; defaults to the latest run of each strategy")
+    parser.add_argument('--output', help="Save the figure to an .html file (or .png, .svg, ... with kaleido) instead of showing it")
+    parser.add_argument('--width', type=int, default=default_width, help="Points drawn per curve and panel")
+    parser.add_argument('--no-panels', action='store_true', help="Draw only the money curves, without drawdown and rolling Sharpe")
+    args = parser.parse_args()
+    run(Dataset(),
+        strategies=args.strategies.split(',') if args.strategies else None,
+        run_ids=args.runs.split(',') if args.runs else None,
+        output_file=args.output, width=args.width, panels=not args.no_panels)
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+# Rolling statistics for one lookback period over the whole panel.
+# Windows are taken over each symbol's own rows (like symbol_data.tail(lookback_period)),
+# not over calendar days, so a missing row widens the window instead of shrinking it.
+class RollingIndicators:
+    def __init__(self, prices, bars, count, mean, std, lookback_period):
+        self.lookback_period = lookback_period
+        self.bars = bars        # Rows seen for the symbol up to and including each date (warm-up bars)
+        self.count = count      # Non-NaN prices inside each window
+        self.mean = mean        # Rolling mean, NaN until the symbol has lookback_period rows
+        self.std = std          # Rolling sample standard deviation (ddof=1, as pandas uses)
+        self.ready = bars >= lookback_period
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.zscore = (prices - mean) / std
+            self.deviation = (prices - mean) / mean  # Percent deviation from the mean
+
+
+# Running sums of each symbol's prices, built once per panel.
+# Every rolling window is then the difference of two cumulative sums, which is O(1)
+# per (date, symbol) regardless of the lookback period, so a single RunningSums can
+# serve any number of lookbacks.
+class RunningSums:
+    def __init__(self, prices, valid):
+        self.prices = prices
+        self.valid = valid
+
+        # Rows seen per symbol so far; this is the len(symbol_data[Date <= current_date]) rule
+        self.bars = np.cumsum(valid, axis=0)
+
+        # Move each symbol's rows to the top of its column, keeping date order, so that
+        # observation k of a symbol sits at row k regardless of gaps in the calendar
+        order = np.argsort(~valid, axis=0, kind='stable')
+        observed = np.take_along_axis(prices, order, axis=0)
+        finite = np.take_along_axis(valid, order, axis=0) & ~np.isnan(observed)
+
+        # Shift by each symbol's first price to keep the sums small and the variance stable
+        first_row = np.argmax(finite, axis=0)
+        self.anchor = np.where(finite.any(axis=0), observed[first_row, np.arange(observed.shape[1])], 0.0)
+        shifted = np.where(finite, observed - self.anchor, 0.0)
+
+        zeros = np.zeros((1, prices.shape[1]))
+        self.count_sum = np.vstack([zeros, np.cumsum(finite, axis=0)])
+        self.value_sum = np.vstack([zeros, np.cumsum(shifted, axis=0)])
+        self.square_sum = np.vstack([zeros, np.cumsum(shifted * shifted, axis=0)])
+
+    def window(self, lookback_period):
+        end = self.bars
+        start = np.maximum(end - lookback_period, 0)
+
+        count = np.take_along_axis(self.count_sum, end, axis=0) - np.take_along_axis(self.count_sum, start, axis=0)
+        total = np.take_along_axis(self.value_sum, end, axis=0) - np.take_along_axis(self.value_sum, start, axis=0)
+        squares = np.take_along_axis(self.square_sum, end, axis=0) - np.take_along_axis(self.square_sum, start, axis=0)
+
+        ready = end >= lookback_period
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(ready & (count > 0), self.anchor + total / count, np.nan)
+            variance = (squares - total * total / count) / (count - 1)
+            std = np.where(ready & (count > 1), np.sqrt(np.maximum(variance, 0.0)), np.nan)
+
+        return RollingIndicators(self.prices, self.bars, count, mean, std, lookback_period)
+
+
+# Compute the rolling indicators of a PricePanel for a single lookback period
+def rolling_indicators(panel, lookback_period):
+    return RunningSums(panel.prices, panel.valid).window(lookback_period)
@@ -0,0 +1,159 @@
+import cProfile
+import collections
+import contextlib
+import json
+import os
+import resource
+import signal
+import sys
+import time
+
+# Stage records of this process, in the order the stages finished
+records = []
+
+# Records of the stages running right now, innermost last; counters go to the innermost one
+active = []
+
+# Print every Nth day of a money curve (0 prints nothing)
+progress_sample_rate = 0
+
+# Profiler run around every stage: None, 'cprofile' or 'sample', and where the profiles are written
+profile_mode = None
+profile_dir = 'profiles'
+sample_interval = 0.005  # Seconds of CPU time between samples of the sampling profiler
+
+
+def configure(sample_rate=None, profiler=None, directory=None):
+    global progress_sample_rate, profile_mode, profile_dir
+    if sample_rate is not None:
+        progress_sample_rate = sample_rate
+    profile_mode = profiler
+    if directory is not None:
+        profile_dir = directory
+
+
+# Add n to a named counter of the running stage (e.g. trades made or prices looked up)
+def count(name, n=1):
+    if active:
+        counters = active[-1]['counters']
+        counters[name] = counters.get(name, 0) + int(n)
+
+
+# Peak resident set size of this process so far, in MB (ru_maxrss is in KB on Linux and bytes on macOS)
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+# Statistical profiler: samples the Python stack every sample_interval seconds of CPU time and counts
+# each distinct stack, written in the collapsed format flame graph tools read
+class SamplingProfiler:
+    def __init__(self, interval=sample_interval):
+        self.interval = interval
+        self.stacks = collections.Counter()
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def enable(self):
+        self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler)
+
+    def dump_stats(self, path):
+        with open(path, 'w') as f:
+            for stack, samples in self.stacks.most_common():
+                f.write(f"{stack} {samples}\n")
+
+
+def _start_profiler(name):
+    if profile_mode == 'cprofile':
+        profiler = cProfile.Profile()
+    elif profile_mode == 'sample':
+        profiler = SamplingProfiler()
+    else:
+        return None, None
+
+    try:
+        profiler.enable()
+    except ValueError:
+        # Signals can only be handled on the main thread
+        print(f"Profiling of {name} skipped: the sampling profiler needs the main thread.")
+        return None, None
+
+    extension = 'prof' if profile_mode == 'cprofile' else 'folded'
+    return profiler, os.path.join(profile_dir, f"{name.replace(':', '-')}-{os.getpid()}.{extension}")
+
+
+# Record wall time, CPU time, memory, rows and counters of a block of work, and profile it if asked.
+# ru_maxrss only ever grows over the life of the process, so a stage records the process's peak when it finished
+# and how far the stage raised it (0 when an earlier stage had already used more).
+# The record is yielded so the block can fill in 'rows'.
+@contextlib.contextmanager
+def stage(name):
+    record = {'stage': name, 'pid': os.getpid(), 'started': time.time(), 'rows': None,
+              'counters': {}, 'succeeded': False, 'profile': None}
+    active.append(record)
+    profiler, profile_path = _start_profiler(name)
+    wall_start, cpu_start, peak_start = time.perf_counter(), time.process_time(), peak_rss_mb()
+    try:
+        yield record
+        record['succeeded'] = True
+    finally:
+        record['wall_seconds'] = time.perf_counter() - wall_start
+        record['cpu_seconds'] = time.process_time() - cpu_start
+        record['process_peak_rss_mb'] = peak_rss_mb()
+        record['peak_rss_growth_mb'] = record['process_peak_rss_mb'] - peak_start
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(profile_path)
+            record['profile'] = profile_path
+        active.remove(record)
+        records.append(record)
+
+
+# Hand this process's records over (e.g. from a worker process to the parent) and forget them
+def take_records():
+    taken = list(records)
+    records.clear()
+    return taken
+
+
+def add_records(new_records):
+    records.extend(new_records)
+
+
+def write_trace(path, **metadata):
+    trace = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'argv': sys.argv, **metadata, 'stages': records}
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(trace, f, indent=2, default=str)
+    os.replace(f"{path}.tmp", path)
+
+
+# Prints a sample of a money curve's days instead of every one, every progress_sample_rate-th day by default
+class ProgressReporter:
+    def __init__(self, label, sample_rate=None):
+        self.label = label
+        self.sample_rate = progress_sample_rate if sample_rate is None else sample_rate
+        self.days = 0
+
+    # One day, as it is simulated
+    def update(self, date, money):
+        if self.sample_rate and self.days % self.sample_rate == 0:
+            print(f"{self.label} Date: {date.strftime('%Y-%m-%d')}, Money: ${money:,.2f}", flush=True)
+        self.days += 1
+
+    # A whole money curve at once
+    def report(self, dates, money):
+        if self.sample_rate:
+            for day in range(-self.days % self.sample_rate, len(dates), self.sample_rate):
+                print(f"{self.label} Date: {dates[day].strftime('%Y-%m-%d')}, Money: ${money[day]:,.2f}", flush=True)
+        self.days += len(dates)
@@ -1,74 +1,265 @@
-import subprocess
+import argparse
+import glob
+import importlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import partial
+import Instrumentation
+import Pipeline
+import PriceData
+import Streaming
+from PriceData import Dataset
+from ResultsStore import run_exists, run_parameters, save_strategy_results
 
-# List of pre-processing scripts (always run before the strategies)
-pre_processing_scripts = [
-    {"file": "StockDataFetcher.py", "description": "Fetch stock data"},
-    {"file": "FindDailyReturns.py", "description": "Calculate daily returns"}
+# List of pre-processing stages (always run before the strategies)
+pre_processing_stages = [
+    {"module": "StockDataFetcher", "description": "Fetch stock data"},
+    {"module": "FindDailyReturns", "description": "Calculate daily returns"}
 ]
 
-# List of strategy scripts (user selects which ones to run)
+# List of strategy stages (user selects which ones to run)
 strategies = {
-    1: {"file": "WorstPerDaySim.py", "description": "WorstPerDay -- The **Worst Per Day Strategy** involves identifying the 10 worst-performing stocks from the previous trading day \n"
+    1: {"module": "WorstPerDaySim", "description": "WorstPerDay -- The **Worst Per Day Strategy** involves identifying the 10 worst-performing stocks from the previous trading day \n"
                                                     "(based on daily returns) and investing a portion of the available capital in each of them. The goal is to capitalize on potential \n"
                                                     "price rebounds by buying stocks that performed poorly and selling them after one day. This strategy aims to take advantage of market \n"
                                                     "corrections or short-term recoveries in underperforming stocks.\n"},
-    2: {"file": "BuyAndHold.py", "description": "BuyAndHold -- Divides capital equally among all stocks in the S&P 500\n"},
-    3: {"file": "MeanReversionSim.py", "description": "MeanReversion -- The Mean Reversion Strategy identifies stocks that have deviated significantly from their historical averages (e.g., moving averages) \n"
-                                                      "and trades them with the expectation that their prices will revert to the mean. The strategy buys stocks that are underperforming \n"
-                                                      "relative to their historical averages, expecting a price recovery. \n"},
-    4: {"file": "Reversal.py", "description": "Reversal -- The Reversal Strategy buys stocks that are underperforming compared to their moving average by a certain threshold, expecting a reversal \n"
-                                                      "back to the average price. It looks for opportunities where stocks have dropped significantly and may rise back to their historical price levels.\n"}
+    2: {"module": "BuyAndHold", "description": "BuyAndHold -- Divides capital equally among all stocks in the universe (the DJIA by default)\n"},
+    3: {"module": "MeanReversion", "description": "MeanReversion -- The Mean Reversion Strategy identifies stocks that have deviated significantly from their historical averages (e.g., moving averages) \n"
+                                                  "and trades them with the expectation that their prices will revert to the mean. The strategy buys stocks that are underperforming \n"
+                                                  "relative to their historical averages, expecting a price recovery. \n"},
+    4: {"module": "Reversal", "description": "Reversal -- The Reversal Strategy buys stocks that are underperforming compared to their moving average by a certain threshold, expecting a reversal \n"
+                                             "back to the average price. It looks for opportunities where stocks have dropped significantly and may rise back to their historical price levels.\n"}
 }
 
-# List of post-processing scripts (always run after the strategies)
-post_processing_scripts = [
-    {"file": "PerformanceAnalyzer.py", "description": "Analyze and compare strategy performance"}
+# List of post-processing stages (always run after the strategies)
+post_processing_stages = [
+    {"module": "PerformanceAnalyzer", "description": "Analyze and compare strategy performance",
+     "outputs": ["strategy_performance_metrics.csv", "strategy_rolling_sharpe.csv"]}
 ]
 
-# Function to run a script
-def run_script(script_file):
+# Optional post-processing stage (--significance)
+significance_stage = {"module": "Significance", "description": "Bootstrap confidence intervals and a reality check",
+                      "outputs": ["strategy_significance.csv"]}
+
+
+# Function to run a stage in this process. Every stage module exposes run(dataset, **params).
+# The stage's timings, rows and counters are recorded for the pipeline trace.
+def run_stage(module_name, dataset, **params):
+    # Streaming stages are recorded under the strategy they run
+    stage_name = f"{module_name}:{params['strategy']}" if 'strategy' in params else module_name
     try:
-        print(f"Running {script_file}...")
-        result = subprocess.run(['python', script_file], check=True)
-        print(f"{script_file} completed successfully.\n")
-    except subprocess.CalledProcessError as e:
-        print(f"Error running {script_file}: {e}")
-        return False
-    return True
-
-# Step 1: Run pre-processing scripts
-print("Starting pre-processing steps...\n")
-for script in pre_processing_scripts:
-    if not run_script(script["file"]):
-        print(f"Failed to complete pre-processing step: {script['file']}. Exiting.")
-        exit(1)
-
-# Step 2: Prompt user to select strategies
-print("Strategy Descriptions:")
-for key, strategy in strategies.items():
-    print(f"{key}. {strategy['description']}")
-
-# Get user input for strategies
-print("Enter the numbers of the strategies you want to run separated by a comma: ")
-selected_strategies = input("For example, 1,2 would run WorstPerDay and BuyAndHold. It is recommended you run BuyAndHold as a baseline.\n").split(',')
-selected_strategies = [int(num.strip()) for num in selected_strategies if num.strip().isdigit() and int(num.strip()) in strategies]
-
-if not selected_strategies:
-    print("No valid strategies selected. Exiting.")
-    exit(0)
-
-# Step 3: Run the selected strategy scripts
-for strategy_num in selected_strategies:
-    strategy = strategies[strategy_num]
-    if not run_script(strategy["file"]):
-        print(f"Failed to complete strategy step: {strategy['file']}. Exiting.")
-        exit(1)
-
-# Step 4: Run post-processing scripts (e.g., Performance Analyzer)
-print("Starting post-processing steps...\n")
-for script in post_processing_scripts:
-    if not run_script(script["file"]):
-        print(f"Failed to complete post-processing step: {script['file']}. Exiting.")
-        exit(1)
-
-print("All steps completed successfully.")
+        print(f"Running {module_name}...")
+        with Instrumentation.stage(stage_name) as record:
+            result = importlib.import_module(module_name).run(dataset, **params)
+            if hasattr(result, '__len__'):
+                record['rows'] = len(result)
+        print(f"{module_name} completed successfully.\n")
+    except Exception as e:
+        print(f"Error running {module_name}: {e}")
+        return False, None
+    return True, result
+
+
+# The dataset the stages run on. The parent process runs its stages on its own; each worker process opens its
+# own Dataset, whose panels come from the memory-mapped cache, so all workers read the same pages instead of
+# holding private copies.
+stage_dataset = None
+
+
+def init_worker(price_csv_file, returns_csv_file, cache_dir, price_dtype, sample_rate, profiler, profile_dir):
+    global stage_dataset
+    stage_dataset = Dataset(price_csv_file, returns_csv_file, cache_dir, price_dtype)
+    Instrumentation.configure(sample_rate, profiler, profile_dir)
+    # A forked worker starts with a copy of the parent's records, which the parent already has
+    Instrumentation.records.clear()
+
+
+# Run a strategy stage, either in batch or through the streaming engine, which replays the price store one date
+# at a time. An incremental run continues the strategy's latest streaming snapshot over the new dates only.
+def run_strategy(module_name, dataset, streaming=False, incremental=False):
+    if streaming or incremental:
+        return run_stage("Streaming", dataset, strategy=module_name, incremental=incremental)
+    return run_stage(module_name, dataset)
+
+
+# Parameters a strategy run is saved (and cached) with
+def strategy_parameters(module_name, streaming=False, price_dtype=PriceData.price_dtype):
+    module = importlib.import_module(module_name)
+    params = {**Streaming.stream_parameters(module), 'mode': 'streaming'} if streaming else run_parameters(module.run)
+    if price_dtype != PriceData.price_dtype:
+        params['price_dtype'] = price_dtype
+    return params
+
+
+# The functions below are the run() of the pipeline's DAG stages (see Pipeline.Stage); 'values' holds
+# the results of the stages each one depends on
+
+def run_pipeline_stage(module_name, params, values):
+    succeeded, _ = run_stage(module_name, stage_dataset, **params)
+    if not succeeded:
+        raise Pipeline.StageError(module_name)
+
+
+# Run a strategy and save its money curve as a new run, with a snapshot of its state when it was streamed;
+# the run id is the stage's result
+def run_strategy_stage(module_name, streaming, incremental, values):
+    succeeded, money_df = run_strategy(module_name, stage_dataset, streaming, incremental)
+    if not succeeded:
+        raise Pipeline.StageError(module_name)
+    params = strategy_parameters(module_name, streaming or incremental, stage_dataset.price_dtype)
+    if streaming or incremental:
+        return Streaming.save_streaming_results(money_df, module_name, params)
+    return save_strategy_results(money_df, importlib.import_module(module_name).strategy_name, params)
+
+
+# Run a post-processing stage on the runs made (or reused) by the strategy stages
+def run_post_processing_stage(module_name, strategy_stages, params, values):
+    run_pipeline_stage(module_name, {'run_ids': [values[name] for name in strategy_stages], **params}, values)
+
+
+# The pipeline as a DAG of stages: pre-processing writes the price and returns files the strategies read,
+# and post-processing takes the strategies' run ids. Returns the stages and the step each belongs to.
+def build_stages(args, dataset, module_names):
+    stages, steps = [], {}
+    data_files = [dataset.price_csv_file, dataset.returns_csv_file]
+
+    if not args.skip_preprocessing:
+        fetch_params = {'source_dir': args.source_dir, 'constituents': args.constituents,
+                        'universe': args.universe, 'years': args.years}
+        # The history fetched ends today, so a new day means a new fetch
+        fetch_inputs = ([args.constituents] if args.constituents else []) + \
+            (sorted(glob.glob(os.path.join(args.source_dir, '*.csv'))) if args.source_dir else [])
+        fetch_outputs = [dataset.price_csv_file] + ([] if args.constituents else ['djia_constituents.csv'])
+        stages.append(Pipeline.Stage("StockDataFetcher", partial(run_pipeline_stage, "StockDataFetcher", fetch_params),
+                                     inputs=fetch_inputs, outputs=fetch_outputs, modules=["StockDataFetcher"],
+                                     params={**fetch_params, 'date': date.today().isoformat()}))
+        stages.append(Pipeline.Stage("FindDailyReturns", partial(run_pipeline_stage, "FindDailyReturns", {}),
+                                     inputs=[dataset.price_csv_file], outputs=[dataset.returns_csv_file],
+                                     modules=["FindDailyReturns"], params={'price_dtype': dataset.price_dtype}))
+        steps.update({"StockDataFetcher": "pre-processing", "FindDailyReturns": "pre-processing"})
+
+    # A cached strategy result is a run id, usable while the run is still in the results store
+    for module_name in module_names:
+        streaming = args.streaming or args.update
+        modules = [module_name] + (["Streaming"] if streaming else [])
+        params = {**strategy_parameters(module_name, streaming, dataset.price_dtype), **({'incremental': True} if args.update else {})}
+        stages.append(Pipeline.Stage(module_name, partial(run_strategy_stage, module_name, args.streaming, args.update),
+                                     inputs=data_files, modules=modules, parallel=True, check=run_exists, params=params))
+        steps[module_name] = "strategy"
+
+    post_stages = post_processing_stages + ([significance_stage] if args.significance else [])
+    for stage in post_stages:
+        params = {'jobs': args.jobs} if stage["module"] == "Significance" else {}
+        stages.append(Pipeline.Stage(stage["module"], partial(run_post_processing_stage, stage["module"], module_names, params),
+                                     outputs=stage["outputs"], modules=[stage["module"]], after=module_names))
+        steps[stage["module"]] = "post-processing"
+    return stages, steps
+
+
+# Map "1,4" or "WorstPerDaySim,Reversal" to strategy numbers, ignoring anything unknown
+def parse_strategy_selection(text):
+    by_module = {strategy["module"].lower(): key for key, strategy in strategies.items()}
+    selected = []
+    for token in text.split(','):
+        token = token.strip()
+        if token.isdigit() and int(token) in strategies:
+            selected.append(int(token))
+        elif token.lower() in by_module:
+            selected.append(by_module[token.lower()])
+    return selected
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the backtesting pipeline.")
+    parser.add_argument('--strategies', help="Comma-separated strategy numbers or module names; prompts when omitted")
+    parser.add_argument('--skip-preprocessing', action='store_true', help="Reuse the existing price and returns data")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="Strategies to run concurrently")
+    parser.add_argument('--universe', default='djia', help="Passed to StockDataFetcher: djia, sp500, tickers:AAPL,MSFT,... or synthetic:N")
+    parser.add_argument('--years', type=float, default=10, help="Passed to StockDataFetcher: years of history to fetch")
+    parser.add_argument('--source-dir', help="Passed to StockDataFetcher: read prices from local CSV files")
+    parser.add_argument('--constituents', help="Passed to StockDataFetcher: constituents CSV to use")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Run the strategies with the streaming engine, one date at a time, instead of in batch")
+    parser.add_argument('--update', action='store_true',
+                        help="Continue each strategy's latest streaming snapshot over the dates added since, instead of the full history")
+    parser.add_argument('--significance', action='store_true',
+                        help="Also bootstrap confidence intervals and a reality check against Buy-and-Hold")
+    parser.add_argument('--progress', type=int, default=0, metavar='N',
+                        help="Print every Nth day of each money curve (0, the default, prints none)")
+    parser.add_argument('--profile', choices=['cprofile', 'sample'],
+                        help="Profile every stage with cProfile or the low-overhead sampling profiler")
+    parser.add_argument('--profile-dir', default=Instrumentation.profile_dir, help="Where the stage profiles are written")
+    parser.add_argument('--trace', default='pipeline_trace.json',
+                        help="JSON file of every stage's wall time, CPU time, memory growth, rows and counters")
+    parser.add_argument('--price-dtype', choices=['float64', 'float32'], default=PriceData.price_dtype,
+                        help="Precision of the price panel; float32 halves its memory at the cost of rounding the prices")
+    parser.add_argument('--force', action='store_true', help="Rerun every stage, even those with a cached result")
+    parser.add_argument('--cache-dir', default=Pipeline.cache_dir, help="Where stage results are cached")
+    parser.add_argument('--cache-limit-mb', type=float, default=Pipeline.cache_limit_mb,
+                        help="Size of the stage cache beyond which the least recently used results are evicted")
+    args = parser.parse_args(argv)
+    Instrumentation.configure(args.progress, args.profile, args.profile_dir)
+
+    # The trace is written even when a stage fails, to show where the time went up to the failure
+    try:
+        return run_pipeline(args)
+    finally:
+        Instrumentation.write_trace(args.trace, jobs=args.jobs, streaming=args.streaming, profile=args.profile)
+        print(f"Pipeline trace saved to '{args.trace}'.")
+
+
+def run_pipeline(args):
+    global stage_dataset
+
+    # The dataset is loaded once and shared by every stage run in this process
+    dataset = Dataset(price_dtype=args.price_dtype)
+    stage_dataset = dataset
+
+    # Step 1: Prompt user to select strategies, unless they were given on the command line
+    if args.strategies is not None:
+        selected_strategies = parse_strategy_selection(args.strategies)
+    else:
+        print("Strategy Descriptions:")
+        for key, strategy in strategies.items():
+            print(f"{key}. {strategy['description']}")
+
+        # Get user input for strategies
+        print("Enter the numbers of the strategies you want to run separated by a comma: ")
+        selected_strategies = parse_strategy_selection(input("For example, 1,2 would run WorstPerDay and BuyAndHold. It is recommended you run BuyAndHold as a baseline.\n"))
+
+    if not selected_strategies:
+        print("No valid strategies selected. Exiting.")
+        return 0
+
+    # Step 2: Run pre-processing, the selected strategies and post-processing as one DAG. Stages whose inputs,
+    # code and parameters are unchanged reuse their cached results, and the strategies run concurrently.
+    module_names = [strategies[strategy_num]["module"] for strategy_num in selected_strategies]
+    stages, steps = build_stages(args, dataset, module_names)
+    cache = Pipeline.StageCache(args.cache_dir, args.cache_limit_mb)
+
+    # Make sure existing price and returns caches are current before the workers map them
+    if args.skip_preprocessing:
+        dataset.panel
+        dataset.returns
+
+    if args.jobs > 1 and len(module_names) > 1:
+        initargs = (dataset.price_csv_file, dataset.returns_csv_file, dataset.cache_dir, dataset.price_dtype,
+                    Instrumentation.progress_sample_rate, Instrumentation.profile_mode, Instrumentation.profile_dir)
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(module_names)), initializer=init_worker, initargs=initargs) as executor:
+            _, outcomes = Pipeline.run_dag(stages, cache, executor, args.force)
+    else:
+        _, outcomes = Pipeline.run_dag(stages, cache, force=args.force)
+
+    for stage in stages:
+        if outcomes[stage.name] == 'failed':
+            print(f"Failed to complete {steps[stage.name]} step: {stage.name}. Exiting.")
+            return 1
+
+    print("All steps completed successfully.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
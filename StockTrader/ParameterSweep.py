@@ -0,0 +1,114 @@
+import argparse
+import importlib
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from PriceData import Dataset
+from Analytics import performance_metrics
+
+# Combinations that share a value of this parameter reuse the same rolling statistics
+shared_parameter = 'lookback_period'
+
+
+# Parse one grid value as an int, a float or, failing both, a string
+def parse_grid_value(value):
+    for parse in (int, float):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
+
+
+# Parse "name=v1,v2,..." into (name, [values])
+def parse_grid_argument(text):
+    name, values = text.split('=', 1)
+    return name.strip(), [parse_grid_value(value.strip()) for value in values.split(',')]
+
+
+# Every combination of the grid's values, as a list of parameter dicts
+def expand_grid(grid):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+# Split combinations into tasks. Combinations with the same lookback go to the same task so the
+# worker computes that lookback's rolling statistics once; large groups are split to keep all workers busy.
+def plan_tasks(combinations, jobs):
+    groups = {}
+    for params in combinations:
+        groups.setdefault(params.get(shared_parameter), []).append(params)
+
+    chunk_size = max(1, -(-len(combinations) // jobs))
+    tasks = []
+    for group in groups.values():
+        for start in range(0, len(group), chunk_size):
+            tasks.append(group[start:start + chunk_size])
+    return tasks
+
+
+# Run one strategy over several parameter combinations and return a metrics row for each.
+# The metrics of all the task's money curves are computed together in one pass.
+def evaluate_combinations(module_name, combinations, dataset):
+    strategy = importlib.import_module(module_name)
+    curves = []
+    for number, params in enumerate(combinations):
+        money_df = strategy.run(dataset, **params)
+        curves.append(money_df.assign(Strategy=number))
+
+    metrics = performance_metrics(pd.concat(curves, ignore_index=True)).sort_index()
+    return [{'Strategy': strategy.strategy_name, **params, **row}
+            for params, row in zip(combinations, metrics.to_dict('records'))]
+
+
+worker_dataset = None
+
+
+def init_worker(price_csv_file, returns_csv_file, cache_dir):
+    global worker_dataset
+    worker_dataset = Dataset(price_csv_file, returns_csv_file, cache_dir)
+
+
+def evaluate_in_worker(module_name, combinations):
+    return evaluate_combinations(module_name, combinations, worker_dataset)
+
+
+# Evaluate every combination of the grid for one strategy, spread across processes
+def run_sweep(module_name, grid, dataset, jobs=os.cpu_count()):
+    combinations = expand_grid(grid)
+
+    if jobs <= 1:
+        rows = evaluate_combinations(module_name, combinations, dataset)
+    else:
+        # Make sure the memory-mapped caches are current before the workers open them
+        dataset.panel
+        dataset.returns
+
+        tasks = plan_tasks(combinations, jobs)
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                 initargs=(dataset.price_csv_file, dataset.returns_csv_file, dataset.cache_dir)) as executor:
+            results = executor.map(evaluate_in_worker, itertools.repeat(module_name), tasks)
+            rows = [row for task_rows in results for row in task_rows]
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate a strategy over a grid of parameter values.")
+    parser.add_argument('strategy', help="Strategy module, e.g. MeanReversion, Reversal or WorstPerDaySim")
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help="Values for one parameter; repeat for each parameter in the grid")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument('--output', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    grid = dict(parse_grid_argument(text) for text in args.grid)
+    start = time.perf_counter()
+    results = run_sweep(args.strategy, grid, Dataset(), args.jobs)
+    elapsed = time.perf_counter() - start
+
+    results.to_csv(args.output, index=False)
+    print(results.sort_values('Sharpe Ratio', ascending=False).head(10).to_string(index=False))
+    print(f"{len(results)} combinations evaluated in {elapsed:.1f}s. Results saved to '{args.output}'.")
@@ -0,0 +1,269 @@
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+import Instrumentation
+
+# The pipeline is a DAG of stages. A stage declares the files it reads and writes; a stage that reads a
+# file another stage writes runs after it. Each stage's result and output files are cached under a hash
+# of its input files, its code, its parameters and the results of the stages it depends on, so a rerun
+# only recomputes the stages whose inputs changed.
+
+cache_dir = 'stage_cache'
+entry_file = 'entry.json'
+digests_file = 'digests.json'  # File digests by size and modification time, so unchanged files are not rehashed
+cache_limit_mb = 2048  # Least recently used entries are evicted beyond this size
+
+
+class StageError(Exception):
+    pass
+
+
+# One stage of the pipeline.
+#   run(values) does the work and returns a JSON-serializable result; 'values' holds the results of the
+#     stages it depends on, by name. It is pickled to a worker process when the stage is 'parallel'.
+#   inputs and outputs are file paths; params are the settings that change the result; modules are the
+#     modules whose code (and local imports) the result depends on; after names stages it depends on
+#     through their results rather than through files; check(value) tells whether a cached result is still usable.
+class Stage:
+    def __init__(self, name, run, inputs=(), outputs=(), params=None, modules=(), after=(), parallel=False, check=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.modules = list(modules)
+        self.after = list(after)
+        self.parallel = parallel
+        self.check = check
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Source files of a module and of every module next to it that it imports, directly or not
+def module_files(module_name, found=None):
+    found = {} if found is None else found
+    spec = importlib.util.find_spec(module_name)
+    if spec is None or not spec.origin or not spec.origin.endswith('.py') or spec.origin in found.values():
+        return found
+    found[module_name] = spec.origin
+
+    with open(spec.origin) as f:
+        tree = ast.parse(f.read())
+    local_dir = os.path.dirname(spec.origin)
+    for node in ast.walk(tree):
+        names = [alias.name for alias in node.names] if isinstance(node, ast.Import) else \
+            [node.module] if isinstance(node, ast.ImportFrom) and node.module and not node.level else []
+        for name in names:
+            if os.path.isfile(os.path.join(local_dir, f"{name.split('.')[0]}.py")):
+                module_files(name.split('.')[0], found)
+    return found
+
+
+# Source files of all of a stage's modules
+def module_files_of(stage):
+    found = {}
+    for module_name in stage.modules:
+        module_files(module_name, found)
+    return found
+
+
+# Content-addressed store of stage results and output files, one directory per key
+class StageCache:
+    def __init__(self, directory=cache_dir, limit_mb=cache_limit_mb):
+        self.directory = directory
+        self.limit_bytes = limit_mb * 2 ** 20
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(os.path.join(directory, digests_file)) as f:
+                self.digests = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.digests = {}
+
+    # SHA-256 of a file's contents, reused while its size and modification time are unchanged
+    def file_digest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        known = self.digests.get(path)
+        if known is None or known['size'] != stat.st_size or known['mtime_ns'] != stat.st_mtime_ns:
+            known = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': _sha256(path)}
+            self.digests[path] = known
+        return known['sha256']
+
+    def save_digests(self):
+        with open(os.path.join(self.directory, f"{digests_file}.tmp"), 'w') as f:
+            json.dump(self.digests, f)
+        os.replace(os.path.join(self.directory, f"{digests_file}.tmp"), os.path.join(self.directory, digests_file))
+
+    # Hash of everything a stage's result depends on; missing input files hash as missing
+    def stage_key(self, stage, dependency_values):
+        code = {name: self.file_digest(path) for name, path in sorted(module_files_of(stage).items())}
+        inputs = {path: self.file_digest(path) if os.path.isfile(path) else None for path in stage.inputs}
+        description = {'stage': stage.name, 'params': stage.params, 'code': code, 'inputs': inputs,
+                       'dependencies': dependency_values, 'outputs': stage.outputs}
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    # The cached result of a stage, with its output files put back in place, or None if there is no usable entry
+    def lookup(self, stage, key):
+        entry_path = os.path.join(self._entry_dir(key), entry_file)
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if stage.check is not None and not stage.check(entry['value']):
+            return None
+
+        for output in entry['outputs']:
+            cached_file = os.path.join(self._entry_dir(key), output['file'])
+            if not os.path.isfile(cached_file):
+                return None
+            # Files that already hold the cached contents are left alone, keeping the caches built from them valid
+            if os.path.isfile(output['path']) and self.file_digest(output['path']) == output['sha256']:
+                continue
+            shutil.copyfile(cached_file, f"{output['path']}.tmp")
+            os.replace(f"{output['path']}.tmp", output['path'])
+
+        # The entry's modification time is its last use
+        os.utime(entry_path)
+        return entry
+
+    # Store a stage's result and a copy of its output files, written to a temporary directory and renamed into place
+    def store(self, stage, key, value):
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        outputs = []
+        for position, path in enumerate(stage.outputs):
+            if not os.path.isfile(path):
+                continue
+            cached_name = f"{position}-{os.path.basename(path)}"
+            shutil.copyfile(path, os.path.join(tmp_dir, cached_name))
+            outputs.append({'path': path, 'file': cached_name, 'sha256': self.file_digest(path)})
+
+        entry = {'stage': stage.name, 'key': key, 'value': value, 'outputs': outputs,
+                 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'bytes': sum(os.path.getsize(os.path.join(tmp_dir, output['file'])) for output in outputs)}
+        with open(os.path.join(tmp_dir, entry_file), 'w') as f:
+            json.dump(entry, f, indent=2, default=str)
+
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+
+    # Remove the least recently used entries until the cache fits its limit, keeping the given keys
+    def evict(self, keep=()):
+        entries = []
+        for key in os.listdir(self.directory):
+            entry_path = os.path.join(self._entry_dir(key), entry_file)
+            if not os.path.isfile(entry_path):
+                continue
+            with open(entry_path) as f:
+                size = json.load(f)['bytes']
+            entries.append((os.path.getmtime(entry_path), key, size))
+
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= self.limit_bytes:
+                break
+            if key in keep:
+                continue
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= size
+            print(f"Evicted cached stage result {key[:12]} ({size / 2 ** 20:.1f} MB).")
+
+
+# Run in a worker process; the worker's stage records go back to the parent with the result
+def _run_in_worker(run, values):
+    return run(values), Instrumentation.take_records()
+
+
+# Run the stages in dependency order, skipping those with a usable cached result (unless 'force') and running
+# 'parallel' stages that are ready at the same time in the executor, when one is given.
+# Returns every stage's result and its outcome: 'cached', 'ran', 'failed' or 'skipped' (a dependency failed).
+def run_dag(stages, cache, executor=None, force=False):
+    by_name = {stage.name: stage for stage in stages}
+    producers = {os.path.abspath(path): stage.name for stage in stages for path in stage.outputs}
+    dependencies = {stage.name: set(stage.after) | {producers[os.path.abspath(path)] for path in stage.inputs
+                                                    if producers.get(os.path.abspath(path), stage.name) != stage.name}
+                    for stage in stages}
+
+    values, outcomes, used_keys = {}, {}, set()
+    waiting = [stage.name for stage in stages]
+    running = {}
+
+    def finish(stage, key, value):
+        values[stage.name] = value
+        outcomes[stage.name] = 'ran'
+        cache.store(stage, key, value)
+        used_keys.add(key)
+
+    # A StageError means the stage has already reported its error
+    def fail(stage, error):
+        outcomes[stage.name] = 'failed'
+        if not isinstance(error, StageError):
+            print(f"Stage {stage.name} failed: {error}")
+
+    try:
+        while waiting or running:
+            started = False
+            for name in list(waiting):
+                if any(outcomes.get(dependency) in ('failed', 'skipped') for dependency in dependencies[name]):
+                    waiting.remove(name)
+                    outcomes[name] = 'skipped'
+                    continue
+                if not all(dependency in values for dependency in dependencies[name]):
+                    continue
+
+                waiting.remove(name)
+                started = True
+                stage = by_name[name]
+                dependency_values = {dependency: values[dependency] for dependency in sorted(dependencies[name])}
+                # Dependencies through files are covered by the input digests; the key takes the results of the others
+                key = cache.stage_key(stage, {dependency: values[dependency] for dependency in sorted(stage.after)})
+                entry = None if force else cache.lookup(stage, key)
+                if entry is not None:
+                    print(f"{name} is up to date (cached as {key[:12]}), skipping.")
+                    values[name] = entry['value']
+                    outcomes[name] = 'cached'
+                    used_keys.add(key)
+                    Instrumentation.add_records([{'stage': name, 'pid': os.getpid(), 'started': time.time(),
+                                                  'cached': key, 'succeeded': True}])
+                elif executor is not None and stage.parallel:
+                    running[executor.submit(_run_in_worker, stage.run, dependency_values)] = (stage, key)
+                else:
+                    try:
+                        finish(stage, key, stage.run(dependency_values))
+                    except Exception as e:
+                        fail(stage, e)
+
+            if running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, key = running.pop(future)
+                    try:
+                        value, records = future.result()
+                        Instrumentation.add_records(records)
+                        finish(stage, key, value)
+                    except Exception as e:
+                        fail(stage, e)
+            elif waiting and not started:
+                raise StageError(f"Stages {', '.join(waiting)} depend on each other or on stages that do not exist.")
+    finally:
+        cache.save_digests()
+        cache.evict(keep=used_keys)
+    return values, outcomes
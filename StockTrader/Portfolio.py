@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+from Instrumentation import count
+
+# Portfolio accounting over a dates x symbols holdings matrix. A strategy gives its target weights: the
+# fraction of the money held in each stock after the close of a rebalancing date (the rest is cash, negative
+# for leverage). Between rebalancing dates nothing is traded and the holdings drift with their prices.
+# 'returns' is the 1-day return panel (Returns' return_1d): the return of each stock from its previous row's
+# close to the date's close. It is measured over the stock's own rows, so a stock with no row on a date is
+# valued at its last price and the move across the gap is booked on the date it trades again; before its first
+# row and after its last one it keeps its value.
+#
+# Each stretch of dates between two rebalancings is valued in one step: the stocks' cumulative returns over
+# the stretch times the weights set at its start is a single matrix-vector product, which gives the value of
+# the holdings on every date of the stretch. Only a block of rows is read at a time, so memory-mapped
+# panels of 10,000 symbols over decades are valued without being loaded.
+#
+# Trading costs are charged on the value traded at each rebalancing, the turnover: transaction costs
+# (commissions and fees) and slippage (the price moving against the order), both in basis points.
+
+transaction_cost_bps = 0.0
+slippage_bps = 0.0
+cash_return = 0.0  # Daily return of the cash, e.g. an annual rate / 252
+block_rows = 256  # Rows of returns read and valued at once
+
+
+# Start and end rows of the stretches between rebalancing rows; the last stretch runs to the end
+def holding_stretches(rebalance_rows, days):
+    starts = np.asarray(rebalance_rows, dtype=int)
+    return zip(starts, np.append(starts[1:], days))
+
+
+# Money after every date's close and what was traded, paid and held, as a frame with a column per series:
+#   Money     value of the holdings and cash after the close and the date's trading costs
+#   Traded    value bought and sold at the close
+#   Turnover  Traded relative to the money before trading
+#   Costs     transaction costs and slippage paid
+#   Cash      money not invested in stocks
+# 'weights' is the target holdings matrix (NaN counts as 0); the portfolio is rebalanced to it on
+# rebalance_rows (every row when None) and is all cash before the first one.
+def simulate_portfolio(dates, weights, returns, initial_money, rebalance_rows=None, transaction_cost_bps=transaction_cost_bps,
+                       slippage_bps=slippage_bps, cash_return=cash_return, block_rows=block_rows):
+    days = len(dates)
+    rebalance_rows = np.arange(days) if rebalance_rows is None else np.asarray(rebalance_rows, dtype=int)
+
+    growth = np.full(days, 1 + cash_return)  # Value of the portfolio at the next close, relative to this close
+    turnover = np.zeros(days)
+    cash_weight = np.ones(days)
+    drifted = np.zeros(weights.shape[1])  # Weights held at the close, before rebalancing
+    for start, end in holding_stretches(rebalance_rows, days):
+        target = np.nan_to_num(np.asarray(weights[start], dtype=float))
+        turnover[start] = np.abs(target - drifted).sum()
+
+        # Long stretches are valued block_rows at a time, each block starting from the weights the last one ended with
+        for block_start in range(start, end, block_rows):
+            block_end = min(block_start + block_rows, end)
+            cash = 1 - target.sum()
+
+            # Value of each stock and of the portfolio at the following closes, per unit of money at block_start.
+            # No date follows the last one, so nothing is earned after it.
+            next_returns = np.zeros((block_end - block_start, weights.shape[1]))
+            following = np.asarray(returns[block_start + 1:block_end + 1], dtype=float)
+            next_returns[:len(following)] = np.nan_to_num(following)
+            stock_growth = np.cumprod(1 + next_returns, axis=0)
+            cash_growth = (1 + cash_return) ** np.arange(1, block_end - block_start + 1)
+            value = stock_growth @ target + cash * cash_growth
+
+            previous_value = np.concatenate([[1.0], value[:-1]])
+            growth[block_start:block_end] = value / previous_value
+            cash_weight[block_start:block_end] = cash * np.concatenate([[1.0], cash_growth[:-1]]) / previous_value
+            with np.errstate(divide='ignore', invalid='ignore'):
+                target = np.nan_to_num(target * stock_growth[-1] / value[-1])
+        drifted = target
+    count('rebalances', len(rebalance_rows))
+
+    # The money before each date's trading is the previous money grown over the day; the costs come out of it
+    cost_rate = (transaction_cost_bps + slippage_bps) / 10000
+    before_trading = initial_money * np.cumprod(np.concatenate([[1.0], growth[:-1]]) * np.concatenate([[1.0], 1 - turnover[:-1] * cost_rate]))
+    costs = before_trading * turnover * cost_rate
+    money = before_trading - costs
+
+    return pd.DataFrame({'Date': dates, 'Money': money, 'Traded': before_trading * turnover, 'Turnover': turnover,
+                         'Costs': costs, 'Cash': money * cash_weight})
+
+
+# Weights that split the money equally over each row's picks (a rows x k array of columns, -1 for an empty slot)
+def equal_weights(picks, width):
+    rows, slots = np.nonzero(picks >= 0)
+    counts = (picks >= 0).sum(axis=1)
+    weights = np.zeros((len(picks), width))
+    weights[rows, picks[rows, slots]] = 1 / counts[rows]
+    return weights
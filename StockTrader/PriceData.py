@@ -0,0 +1,206 @@
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import PriceStore
+from Indicators import RunningSums
+from Returns import load_returns
+
+# Price precision of the panel: float64 by default, float32 to halve the memory of the prices
+price_dtype = 'float64'
+
+# Columns of the price CSV kept as text; they are read as categoricals, so each distinct string is stored once
+text_columns = ['Symbol', 'Company']
+
+scan_rows = 256  # Rows of the validity mask read at a time when looking for each symbol's last row
+indicator_cache_size = 16  # Lookback periods whose rolling indicators a Dataset keeps, least recently used first out
+
+
+# Last row on which each symbol has data (-1 for symbols that never do). The mask is scanned backwards a block
+# of rows at a time until every symbol is found, so a memory-mapped mask is never copied whole; usually only
+# the last block is read.
+def last_valid_rows(valid, block_rows=scan_rows):
+    last_rows = np.full(valid.shape[1], -1)
+    pending = np.arange(valid.shape[1])
+    for end in range(valid.shape[0], 0, -block_rows):
+        block = np.asarray(valid[max(end - block_rows, 0):end])[:, pending]
+        found = block.any(axis=0)
+        last_rows[pending[found]] = end - 1 - np.argmax(block[::-1, found], axis=0)
+        pending = pending[~found]
+        if not pending.size:
+            break
+    return last_rows
+
+
+# Dense dates x symbols view of the price dataset.
+# Rows follow the trading calendar (every date present in the data, sorted) and
+# columns follow the order in which symbols first appear in the CSV, which is the
+# same order the strategies get from stock_data['Symbol'].unique().
+class PricePanel:
+    def __init__(self, dates, symbols, prices, valid):
+        self.dates = pd.DatetimeIndex(dates)     # Trading calendar
+        self.symbols = np.asarray(symbols, dtype=object)
+        self.prices = prices                     # Adjusted close, NaN where there is no row
+        self.valid = valid                       # True where the CSV has a row for (date, symbol)
+
+        # Lookup tables from labels to panel positions
+        self.date_index = {date: i for i, date in enumerate(self.dates)}
+        self.symbol_index = {symbol: j for j, symbol in enumerate(self.symbols)}
+
+    @property
+    def shape(self):
+        return self.prices.shape
+
+    # Row index of the first date on which the symbol has data (-1 if it never does)
+    def first_valid_row(self, symbol_col):
+        rows = np.flatnonzero(self.valid[:, symbol_col])
+        return rows[0] if rows.size else -1
+
+    # First and last row on which each symbol has data (-1 for symbols that never do). Together with the
+    # validity mask they describe ragged histories: symbols listing late, delisting early or skipping dates.
+    def first_valid_rows(self):
+        return np.where(self.valid.any(axis=0), np.argmax(self.valid, axis=0), -1)
+
+    def last_valid_rows(self):
+        return last_valid_rows(self.valid)
+
+    # Adjusted close for a (date, symbol) label pair, or None if the data has no row for it
+    def price(self, date, symbol):
+        i = self.date_index.get(pd.Timestamp(date))
+        j = self.symbol_index.get(symbol)
+        if i is None or j is None or not self.valid[i, j]:
+            return None
+        return self.prices[i, j]
+
+
+# Dates as int32 day ordinals (days since 1970-01-01), and back
+def day_ordinals(dates):
+    return pd.to_datetime(dates).to_numpy().astype('datetime64[D]').astype(np.int32)
+
+
+def ordinal_dates(ordinals):
+    return np.asarray(ordinals, dtype='datetime64[D]').astype('datetime64[ns]')
+
+
+# Read the price CSV in a compact long format: only Date, Symbol and the requested columns, with symbols
+# (and company names) as categoricals, dates as int32 day ordinals and prices as price_dtype. Prices are parsed
+# exactly, so a panel read from the CSV is bit-identical to the one cached from the frame the CSV was written from.
+def load_price_frame(csv_file='djia_all_data.csv', columns=('Adj Close',), price_dtype=price_dtype):
+    columns = [column for column in columns if column not in ['Date', 'Symbol']]
+    dtypes = {column: 'category' if column in text_columns else price_dtype for column in ['Symbol', *columns]}
+    stock_data = pd.read_csv(csv_file, usecols=['Date', 'Symbol', *columns], dtype=dtypes, float_precision='round_trip')
+    stock_data['Date'] = day_ordinals(stock_data['Date'])
+    return stock_data
+
+
+# Build a PricePanel from a long-format frame with Date (datetimes or int32 day ordinals), Symbol and price columns
+def build_price_panel(stock_data, price_column='Adj Close', price_dtype=price_dtype):
+    stock_data = stock_data[['Date', 'Symbol', price_column]]
+
+    # The strategies always took the first matching row, so keep that one on duplicates
+    stock_data = stock_data.drop_duplicates(subset=['Date', 'Symbol'], keep='first')
+
+    # Day ordinals are compared as integers; only the distinct dates are converted back to datetimes
+    if pd.api.types.is_integer_dtype(stock_data['Date']):
+        days, date_codes = np.unique(stock_data['Date'].to_numpy(), return_inverse=True)
+        dates = ordinal_dates(days)
+    else:
+        dates, date_codes = np.unique(pd.to_datetime(stock_data['Date']).values, return_inverse=True)
+    symbol_codes, symbols = pd.factorize(stock_data['Symbol'], sort=False)
+
+    prices = np.full((len(dates), len(symbols)), np.nan, dtype=price_dtype)
+    valid = np.zeros((len(dates), len(symbols)), dtype=bool)
+    prices[date_codes, symbol_codes] = stock_data[price_column].to_numpy(dtype=price_dtype)
+    valid[date_codes, symbol_codes] = True
+
+    return PricePanel(dates, np.asarray(symbols, dtype=object), prices, valid)
+
+
+# Cache group of a price column; panels of a lower precision are cached separately
+def _price_group(price_column, price_dtype=price_dtype):
+    group = price_column.lower().replace(' ', '_')
+    return group if np.dtype(price_dtype) == np.float64 else f"{group}.{np.dtype(price_dtype).name}"
+
+
+# Save a panel to the binary cache, tagged with the CSV it was built from
+def write_price_cache(panel, csv_file='djia_all_data.csv', price_column='Adj Close', cache_dir=PriceStore.cache_dir):
+    PriceStore.write_arrays(_price_group(price_column, panel.prices.dtype), {
+        'dates': panel.dates.asi8,
+        'symbols': np.asarray(panel.symbols, dtype=str),
+        'prices': panel.prices,
+        'valid': panel.valid,
+    }, [csv_file], cache_dir)
+
+
+# Open the price panel from the binary cache (memory-mapped, read-only) when it is up to date with the CSV,
+# otherwise read the combined price CSV once, align it to the trading calendar and refresh the cache
+def load_price_panel(csv_file='djia_all_data.csv', price_column='Adj Close', use_cache=True, cache_dir=PriceStore.cache_dir,
+                     price_dtype=price_dtype):
+    if use_cache:
+        cached = PriceStore.read_arrays(_price_group(price_column, price_dtype), [csv_file], cache_dir)
+        if cached is not None:
+            return PricePanel(cached['dates'], cached['symbols'], cached['prices'], cached['valid'])
+
+    stock_data = load_price_frame(csv_file, [price_column], price_dtype)
+    panel = build_price_panel(stock_data, price_column, price_dtype)
+
+    if use_cache:
+        write_price_cache(panel, csv_file, price_column, cache_dir)
+    return panel
+
+
+# Open the cached price arrays (memory-mapped, read-only) without building a panel, refreshing the cache from
+# the CSV first if it is missing or stale. Used by the streaming engine to read one date at a time.
+def open_price_arrays(csv_file='djia_all_data.csv', price_column='Adj Close', cache_dir=PriceStore.cache_dir,
+                      price_dtype=price_dtype):
+    arrays = PriceStore.read_arrays(_price_group(price_column, price_dtype), [csv_file], cache_dir)
+    if arrays is None:
+        load_price_panel(csv_file, price_column, cache_dir=cache_dir, price_dtype=price_dtype)
+        arrays = PriceStore.read_arrays(_price_group(price_column, price_dtype), [csv_file], cache_dir)
+    return arrays
+
+
+# Everything the pipeline stages read, loaded on first use and shared by every stage in the process
+class Dataset:
+    def __init__(self, price_csv_file='djia_all_data.csv', returns_csv_file='djia_daily_returns.csv',
+                 cache_dir=PriceStore.cache_dir, price_dtype=price_dtype, indicator_cache_size=indicator_cache_size):
+        self.price_csv_file = price_csv_file
+        self.returns_csv_file = returns_csv_file
+        self.cache_dir = cache_dir
+        self.price_dtype = price_dtype
+        self.indicator_cache_size = indicator_cache_size
+        self.reload()
+
+    # Forget loaded data, e.g. after a pre-processing stage has rewritten the CSVs
+    def reload(self):
+        self._panel = None
+        self._returns = None
+        self._running_sums = None
+        self._indicators = OrderedDict()
+
+    @property
+    def panel(self):
+        if self._panel is None:
+            self._panel = load_price_panel(self.price_csv_file, cache_dir=self.cache_dir, price_dtype=self.price_dtype)
+        return self._panel
+
+    # Precomputed returns keyed by name (see Returns.compute_returns), each aligned to the panel
+    @property
+    def returns(self):
+        if self._returns is None:
+            self._returns = load_returns(self.panel, self.price_csv_file, self.cache_dir)
+        return self._returns
+
+    # Rolling indicators for a lookback period, computed once per process and reused by every
+    # strategy run (or sweep combination) that asks for the same lookback. Only the last
+    # indicator_cache_size lookbacks used are kept, so a long-lived process asked for many
+    # lookbacks does not keep growing.
+    def indicators(self, lookback_period):
+        if lookback_period in self._indicators:
+            self._indicators.move_to_end(lookback_period)
+        else:
+            if self._running_sums is None:
+                self._running_sums = RunningSums(self.panel.prices, self.panel.valid)
+            self._indicators[lookback_period] = self._running_sums.window(lookback_period)
+            while len(self._indicators) > self.indicator_cache_size:
+                self._indicators.popitem(last=False)
+        return self._indicators[lookback_period]
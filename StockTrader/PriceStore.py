@@ -0,0 +1,84 @@
+import json
+import os
+import numpy as np
+
+# Default location of the binary cache, next to the CSVs it is built from
+cache_dir = 'djia_cache'
+manifest_suffix = '.manifest.json'
+
+
+# Identify a source file by size and modification time; a rewritten CSV changes both
+def source_fingerprint(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+# Every group has its own manifest, so processes writing different groups at the same time (the price panel
+# and the returns store, say) never read, change and rewrite the same file and cannot drop each other's entries
+def _manifest_path(directory, group):
+    return os.path.join(directory, f"{group}{manifest_suffix}")
+
+
+def _read_manifest(directory, group):
+    try:
+        with open(_manifest_path(directory, group)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# Write a file next to its final path and rename it into place so readers never see a partial file
+def _atomic_write(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _array_path(directory, group, name):
+    return os.path.join(directory, f"{group}.{name}.npy")
+
+
+# Store a group of named arrays as one .npy file each, tagged with the source files they came from
+def write_arrays(group, arrays, source_files, directory=cache_dir):
+    os.makedirs(directory, exist_ok=True)
+
+    for name, array in arrays.items():
+        def save(tmp_path, array=array):
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+        _atomic_write(_array_path(directory, group, name), save)
+
+    # Record the group only after all its arrays are in place
+    entry = {
+        'arrays': sorted(arrays),
+        'sources': {os.path.abspath(path): source_fingerprint(path) for path in source_files},
+    }
+
+    def save_manifest(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f, indent=2)
+    _atomic_write(_manifest_path(directory, group), save_manifest)
+
+
+# Open a group of arrays memory-mapped read-only, or return None if it is missing or its sources changed.
+# The pages are shared through the OS page cache, so every process that opens the store reads the same memory.
+def read_arrays(group, source_files, directory=cache_dir):
+    entry = _read_manifest(directory, group)
+    if entry is None:
+        return None
+
+    try:
+        sources = {os.path.abspath(path): source_fingerprint(path) for path in source_files}
+    except FileNotFoundError:
+        return None
+    if sources != entry['sources']:
+        return None
+
+    try:
+        return {name: np.load(_array_path(directory, group, name), mmap_mode='r') for name in entry['arrays']}
+    except (FileNotFoundError, ValueError):
+        return None
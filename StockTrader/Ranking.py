@@ -0,0 +1,44 @@
+import numpy as np
+
+
+# Column indices of the k smallest keys on every row, ordered from smallest to largest.
+# Ties are broken by column order, which is what DataFrame.nsmallest(keep='first') does when the
+# rows are in symbol order. Excluded entries must carry +inf; slots beyond the number of
+# included entries are -1. A k larger than the number of columns is capped at it, so a huge
+# k costs no more memory than ranking every column.
+def _rank_smallest(keys, included, k):
+    num_rows, num_columns = keys.shape
+    width = min(k, num_columns)
+    if width == 0 or num_rows == 0:
+        return np.full((num_rows, width), -1)
+
+    # Partial sort: pick the k smallest of each row, then order just those k by (key, column)
+    picked = np.argpartition(keys, width - 1, axis=1)[:, :width]
+    picked_keys = np.take_along_axis(keys, picked, axis=1)
+    order = np.lexsort((picked, picked_keys), axis=1)
+    picked = np.take_along_axis(picked, order, axis=1)
+
+    # When the k-th key is tied with keys left outside the pick, the partition may have taken a later
+    # column than the tie-break allows; those rows are ranked again with a full stable sort
+    kth_key = picked_keys.max(axis=1, keepdims=True)
+    ties_outside = (keys == kth_key).sum(axis=1) > (picked_keys == kth_key).sum(axis=1)
+    for row in np.flatnonzero(ties_outside & np.isfinite(kth_key[:, 0])):
+        picked[row] = np.argsort(keys[row], kind='stable')[:width]
+
+    # Excluded entries only get picked when a row has fewer than k included ones
+    picked[~np.take_along_axis(included, picked, axis=1)] = -1
+    return picked
+
+
+# The k lowest values of every row (e.g. the k worst daily returns of each date), skipping
+# entries that are missing or NaN. Returns a rows x min(k, columns) array of column indices padded
+# with -1.
+def bottom_k(values, valid, k):
+    included = valid & ~np.isnan(values)
+    return _rank_smallest(np.where(included, values, np.inf), included, k)
+
+
+# The k highest values of every row, highest first, with the same tie and padding rules
+def top_k(values, valid, k):
+    included = valid & ~np.isnan(values)
+    return _rank_smallest(np.where(included, -values, np.inf), included, k)
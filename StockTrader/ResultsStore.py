@@ -0,0 +1,130 @@
+import inspect
+import json
+import os
+import shutil
+import time
+import uuid
+import pandas as pd
+
+# Every run's money curve goes to its own file, results/<strategy>/<run_id>.csv, and gets one
+# line in results/index.jsonl. Nothing is ever rewritten, so strategies running at the same time
+# cannot lose each other's results.
+results_dir = 'results'
+index_file = 'index.jsonl'
+
+
+# Parameters a strategy run used: the defaults of its run() function with any overrides applied
+def run_parameters(run_function, **overrides):
+    params = {name: parameter.default for name, parameter in inspect.signature(run_function).parameters.items()
+              if parameter.default is not inspect.Parameter.empty}
+    params.update(overrides)
+    return params
+
+
+def _new_run_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+# Save one strategy run and return its run id. A run that continues another (base_run_id) starts with
+# that run's rows, followed by the rows of money_df.
+def save_strategy_results(money_df, strategy_name, params=None, directory=results_dir, base_run_id=None):
+    run_id = _new_run_id()
+    strategy_dir = os.path.join(directory, strategy_name)
+    os.makedirs(strategy_dir, exist_ok=True)
+
+    money_df = money_df.drop(columns=['Strategy'], errors='ignore').copy()
+
+    # Convert 'Date' to string in YYYY-MM-DD format before saving
+    money_df['Date'] = pd.to_datetime(money_df['Date']).dt.strftime('%Y-%m-%d')
+
+    # Write the curve under a temporary name and rename it, so readers never see a partial file
+    path = os.path.join(strategy_dir, f"{run_id}.csv")
+    rows = len(money_df)
+    if base_run_id is None:
+        money_df.to_csv(f"{path}.tmp", index=False)
+    else:
+        base = list_runs(directory=directory).set_index('run_id').loc[base_run_id]
+        base_path = os.path.join(directory, base['path'])
+        shutil.copyfile(base_path, f"{path}.tmp")
+        money_df[pd.read_csv(base_path, nrows=0).columns].to_csv(f"{path}.tmp", mode='a', header=False, index=False)
+        rows += base['rows']
+    os.replace(f"{path}.tmp", path)
+
+    # Register the run with a single append; O_APPEND writes of one short line do not interleave
+    entry = {
+        'run_id': run_id,
+        'strategy': strategy_name,
+        'params': params or {},
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'rows': int(rows),
+        'path': os.path.relpath(path, directory),
+    }
+    fd = os.open(os.path.join(directory, index_file), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(entry, default=str) + '\n').encode())
+    finally:
+        os.close(fd)
+
+    return run_id
+
+
+# All registered runs, oldest first, optionally only those of some strategies
+def list_runs(strategies=None, directory=results_dir):
+    try:
+        with open(os.path.join(directory, index_file)) as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        runs = []
+
+    runs = pd.DataFrame(runs, columns=['run_id', 'strategy', 'params', 'created', 'rows', 'path'])
+    if strategies is not None:
+        runs = runs[runs['strategy'].isin(strategies)]
+    return runs.reset_index(drop=True)
+
+
+# True if the run is registered and its curve is still on disk
+def run_exists(run_id, directory=results_dir):
+    runs = list_runs(directory=directory)
+    paths = runs.loc[runs['run_id'] == run_id, 'path']
+    return len(paths) > 0 and os.path.isfile(os.path.join(directory, paths.iloc[0]))
+
+
+# The most recent run of each strategy
+def latest_runs(strategies=None, directory=results_dir):
+    runs = list_runs(strategies, directory)
+    return runs.drop_duplicates(subset='strategy', keep='last').reset_index(drop=True)
+
+
+# Load the money curves of the requested runs (by default the latest run of each strategy) as one
+# long frame with Date, Money, Strategy and RunId columns. Only the requested files are read.
+def load_runs(run_ids=None, strategies=None, directory=results_dir):
+    if run_ids is None:
+        runs = latest_runs(strategies, directory)
+    else:
+        runs = list_runs(strategies, directory)
+        runs = runs[runs['run_id'].isin(run_ids)]
+
+    frames = []
+    for run in runs.itertuples():
+        # The C parser's default float parsing can be off by one ulp; round_trip reads back exactly what was written
+        money_df = pd.read_csv(os.path.join(directory, run.path), parse_dates=['Date'], float_precision='round_trip')
+        money_df['Strategy'] = run.strategy
+        money_df['RunId'] = run.run_id
+        frames.append(money_df)
+
+    # Several runs of one strategy are told apart by their run id
+    repeated = runs['strategy'].duplicated(keep=False).to_numpy()
+    for frame, run, is_repeated in zip(frames, runs.itertuples(), repeated):
+        if is_repeated:
+            frame['Strategy'] = f"{run.strategy} [{run.run_id}]"
+
+    if not frames:
+        return pd.DataFrame(columns=['Date', 'Money', 'Strategy', 'RunId'])
+    return pd.concat(frames, ignore_index=True)
+
+
+# Write the latest run of each strategy to a single CSV in the old strategy_comparison.csv layout
+def export_comparison(csv_file='strategy_comparison.csv', strategies=None, directory=results_dir):
+    data = load_runs(strategies=strategies, directory=directory)[['Date', 'Money', 'Strategy']]
+    data['Date'] = data['Date'].dt.strftime('%Y-%m-%d')
+    data.to_csv(csv_file, index=False)
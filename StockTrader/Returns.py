@@ -0,0 +1,63 @@
+import numpy as np
+import PriceStore
+
+# Trailing horizons, in each symbol's own rows, of the simple returns in the store
+horizons = [1, 5, 20]
+store_group = 'returns'
+
+
+# Every return series in the store, each a dates x symbols array with NaN where it is undefined:
+#   return_{h}d        simple return over the symbol's last h rows (pct_change(h) per symbol)
+#   log_return_1d      log of the 1-day gross return
+#   forward_return_1d  return from this date's close to the next date's close, the trade every strategy makes
+def compute_returns(prices, valid):
+    # Move each symbol's rows to the top of its column, in date order, so that lags count rows, not calendar days
+    order = np.argsort(~valid, axis=0, kind='stable')
+    observed = np.take_along_axis(prices, order, axis=0)
+    observed_valid = np.take_along_axis(valid, order, axis=0)
+
+    # Forward-fill NaN prices within each symbol, as pct_change does by default
+    rows = np.arange(observed.shape[0])[:, None]
+    last_price_row = np.maximum.accumulate(np.where(np.isnan(observed), 0, rows), axis=0)
+    filled = np.take_along_axis(observed, last_price_row, axis=0)
+
+    store = {}
+    for horizon in horizons:
+        lagged = np.full(filled.shape, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lagged[horizon:] = filled[horizon:] / filled[:-horizon] - 1
+
+        # Scatter back to the calendar grid, leaving dates without a row undefined
+        returns = np.empty(prices.shape)
+        np.put_along_axis(returns, order, np.where(observed_valid, lagged, np.nan), axis=0)
+        store[f'return_{horizon}d'] = returns
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        store['log_return_1d'] = np.log1p(store['return_1d'])
+
+    forward = np.full(prices.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        forward[:-1] = np.where(valid[:-1] & valid[1:], prices[1:] / prices[:-1] - 1, np.nan)
+    store['forward_return_1d'] = forward
+
+    return store
+
+
+# Returns computed from lower precision prices are stored separately
+def _store_group(price_dtype):
+    return store_group if np.dtype(price_dtype) == np.float64 else f"{store_group}.{np.dtype(price_dtype).name}"
+
+
+def write_returns(store, price_csv_file, cache_dir=PriceStore.cache_dir, price_dtype=np.float64):
+    PriceStore.write_arrays(_store_group(price_dtype), store, [price_csv_file], cache_dir)
+
+
+# Open the returns store for a price panel, computing and saving it first if it is missing or stale
+def load_returns(panel, price_csv_file, cache_dir=PriceStore.cache_dir):
+    store = PriceStore.read_arrays(_store_group(panel.prices.dtype), [price_csv_file], cache_dir)
+    if store is not None and store['return_1d'].shape == panel.shape:
+        return store
+
+    store = compute_returns(panel.prices, panel.valid)
+    write_returns(store, price_csv_file, cache_dir, panel.prices.dtype)
+    return store
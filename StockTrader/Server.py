@@ -0,0 +1,354 @@
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import os
+import signal
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qsl, urlsplit
+import PriceData
+from PriceData import Dataset
+from Analytics import performance_metrics
+from Main import strategies
+from ParameterSweep import parse_grid_value
+from ResultsStore import run_parameters
+
+# A resident backtest service. The worker processes open the price panel and returns store once and keep the
+# rolling indicators they compute, so a request only runs the strategy itself; results are kept in an LRU cache
+# keyed by strategy and parameters, and a repeated request is answered without running anything.
+# The front end speaks plain HTTP/1.1 with JSON bodies, on localhost and/or a Unix socket:
+#   POST /run         {"strategy": "MeanReversion", "params": {"lookback_period": 20}, "curve": false}
+#   GET  /run?strategy=MeanReversion&lookback_period=20
+#   GET  /strategies  the strategies and their default parameters
+#   GET  /stats       cache hits, misses and size
+# e.g. curl -s localhost:8765/run -d '{"strategy": "Reversal"}' or curl --unix-socket backtest.sock http://localhost/stats
+
+host = '127.0.0.1'
+port = 8765
+cache_size = 256  # Results kept, least recently used first out
+max_body_bytes = 2 ** 20
+
+# Parameters with an upper bound: counts of stocks are at most the symbols in the panel, fractions of the money at most 1
+stock_count_parameters = ('num_stocks',)
+fraction_suffix = '_fraction'
+
+# Strategies served, by module name and by strategy name
+strategy_modules = {}
+for stage in strategies.values():
+    strategy_modules[stage['module']] = stage['module']
+    strategy_modules[importlib.import_module(stage['module']).strategy_name] = stage['module']
+
+reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+worker_dataset = None
+
+
+# Open the dataset once per worker, with its panels read in, so no request pays for loading them. Ctrl-C
+# stops the server, which then shuts the workers down.
+def init_worker(price_csv_file, returns_csv_file, cache_dir, price_dtype):
+    global worker_dataset
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_dataset = Dataset(price_csv_file, returns_csv_file, cache_dir, price_dtype)
+    worker_dataset.panel
+    worker_dataset.returns
+
+
+# A request's parameters over the defaults of the strategy's run(), each converted to the type of its default
+# and checked against its range: counts, periods and money are whole numbers of at least 1, counts of stocks at
+# most num_symbols, fractions and thresholds finite and not negative, fractions at most 1, and choices text.
+# The result cache is keyed by the converted values, so 20 and 20.0 are the same run.
+def coerce_parameters(module, requested, num_symbols):
+    params = run_parameters(module.run)
+    unknown = set(requested) - set(params)
+    if unknown:
+        raise RequestError(400, f"Unknown parameters for {module.__name__}: {', '.join(sorted(unknown))}.")
+
+    for name, value in requested.items():
+        default = params[name]
+        if isinstance(default, str):
+            if not isinstance(value, str):
+                raise RequestError(400, f"Parameter '{name}' must be text, got {value!r}.")
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise RequestError(400, f"Parameter '{name}' must be a number, got {value!r}.")
+        elif isinstance(default, int):
+            if not float(value).is_integer() or value < 1:
+                raise RequestError(400, f"Parameter '{name}' must be a whole number of at least 1, got {value!r}.")
+            if name in stock_count_parameters and value > num_symbols:
+                raise RequestError(400, f"Parameter '{name}' must be at most the {num_symbols} stocks in the data, got {value!r}.")
+            value = int(value)
+        elif not math.isfinite(value) or value < 0:
+            raise RequestError(400, f"Parameter '{name}' must be a finite number of at least 0, got {value!r}.")
+        elif name.endswith(fraction_suffix) and value > 1:
+            raise RequestError(400, f"Parameter '{name}' must be a fraction between 0 and 1, got {value!r}.")
+        else:
+            value = float(value)
+        params[name] = value
+    return params
+
+
+# NaN and infinite metrics are sent as null, which JSON can represent
+def _number(value):
+    return float(value) if math.isfinite(value) else None
+
+
+def run_in_worker(module_name, params):
+    start = time.perf_counter()
+    money_df = importlib.import_module(module_name).run(worker_dataset, **params)
+    if money_df.empty:
+        raise ValueError(f"no dates to trade over the {len(worker_dataset.panel.dates)}-day history with these parameters.")
+    metrics = performance_metrics(money_df).iloc[0]
+    return {
+        'metrics': {name: _number(value) for name, value in metrics.items()},
+        'curve': {'Date': money_df['Date'].dt.strftime('%Y-%m-%d').tolist(),
+                  'Money': [_number(value) for value in money_df['Money']],
+                  'Traded': [_number(value) for value in money_df['Traded']]},
+        'run_seconds': time.perf_counter() - start,
+    }
+
+
+class ResultCache:
+    def __init__(self, size=cache_size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class BacktestServer:
+    def __init__(self, dataset, jobs=os.cpu_count(), cache_size=cache_size):
+        self.dataset = dataset
+        self.jobs = jobs
+        self.cache = ResultCache(cache_size)
+        self.pending = {}  # Runs in progress and their executor, shared by identical requests that arrive meanwhile
+        self.executor = None
+        self.data_version = None
+        self.restart_lock = asyncio.Lock()
+
+    # Size and modification time of the data files; a change means the data was refreshed
+    def current_data_version(self):
+        return [(os.stat(path).st_size, os.stat(path).st_mtime_ns) if os.path.isfile(path) else None
+                for path in (self.dataset.price_csv_file, self.dataset.returns_csv_file)]
+
+    # Bring the memory-mapped caches up to date with the data files, before the workers open them
+    def load_data(self):
+        self.dataset.reload()
+        self.dataset.panel
+        self.dataset.returns
+
+    def new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.jobs, initializer=init_worker,
+                                   initargs=(self.dataset.price_csv_file, self.dataset.returns_csv_file,
+                                             self.dataset.cache_dir, self.dataset.price_dtype))
+
+    # Start the workers on the current data. The data is loaded in a thread, so the event loop keeps
+    # answering meanwhile; runs that need the new data wait for the restart.
+    async def start_workers(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        data_version = self.current_data_version()
+        await asyncio.to_thread(self.load_data)
+        self.executor = self.new_executor()
+        self.cache.clear()
+        self.data_version = data_version
+
+    # A worker that dies (e.g. killed for running out of memory) breaks the whole pool: every run in it fails
+    # and no more can be submitted, so the pool is replaced. The data is unchanged, and so is the cache.
+    async def replace_broken_executor(self, executor):
+        async with self.restart_lock:
+            # Another request may have replaced it already
+            if self.executor is executor:
+                print("A worker process died; starting new workers.", flush=True)
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = self.new_executor()
+
+    # Run every strategy with its default parameters, which starts the workers and fills the cache
+    async def warm_up(self):
+        start = time.perf_counter()
+        await asyncio.gather(*(self.run_strategy({'strategy': stage['module']}) for stage in strategies.values()))
+        print(f"Warmed up {len(strategies)} strategies in {time.perf_counter() - start:.2f}s.", flush=True)
+
+    async def run_strategy(self, request):
+        module_name = strategy_modules.get(request.get('strategy'))
+        if module_name is None:
+            raise RequestError(404, f"Unknown strategy {request.get('strategy')!r}; use one of {', '.join(sorted(strategy_modules))}.")
+        requested = request.get('params') or {}
+        if not isinstance(requested, dict):
+            raise RequestError(400, "'params' must be an object.")
+
+        if self.current_data_version() != self.data_version:
+            async with self.restart_lock:
+                # Another request may have restarted the workers while this one waited
+                if self.current_data_version() != self.data_version:
+                    print("The data files changed; reloading the workers and clearing the cache.", flush=True)
+                    await self.start_workers()
+        params = coerce_parameters(importlib.import_module(module_name), requested, len(self.dataset.panel.symbols))
+
+        key = (module_name, json.dumps(params, sort_keys=True, default=str))
+        result = self.cache.get(key)
+        if result is not None:
+            return module_name, params, result, True
+        data_version = self.data_version
+        future = executor = None
+        try:
+            if key not in self.pending:
+                self.pending[key] = (asyncio.get_running_loop().run_in_executor(self.executor, run_in_worker, module_name, params),
+                                     self.executor)
+            future, executor = self.pending[key]
+            result = await asyncio.shield(future)
+        except (TypeError, ValueError) as e:
+            raise RequestError(400, f"{module_name} failed: {e}") from e
+        except BrokenProcessPool as e:
+            await self.replace_broken_executor(executor or self.executor)
+            raise RequestError(503, "A worker process died during the run; the workers were restarted, try again.") from e
+        except asyncio.CancelledError:
+            if future is None or not future.cancelled():
+                raise
+            raise RequestError(503, "The data changed before the run started; try again.")
+        finally:
+            if future is not None and self.pending.get(key, (None,))[0] is future:
+                del self.pending[key]
+
+        # A run that started on data replaced since is returned but not kept
+        if self.data_version == data_version:
+            self.cache.put(key, result)
+        return module_name, params, result, False
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == '/run':
+            if method == 'POST':
+                try:
+                    request = json.loads(body or b'{}')
+                except json.JSONDecodeError as e:
+                    raise RequestError(400, f"Invalid JSON: {e}") from e
+                if not isinstance(request, dict):
+                    raise RequestError(400, "The request must be a JSON object.")
+            elif method == 'GET':
+                query = dict(parse_qsl(url.query))
+                request = {'strategy': query.pop('strategy', None), 'curve': query.pop('curve', 'true') != 'false',
+                           'params': {name: parse_grid_value(value) for name, value in query.items()}}
+            else:
+                raise RequestError(405, f"{method} is not supported on /run.")
+
+            start = time.perf_counter()
+            module_name, params, result, cached = await self.run_strategy(request)
+            response = {'strategy': module_name, 'params': params, 'cached': cached, **result,
+                        'seconds': time.perf_counter() - start}
+            if not request.get('curve', True):
+                del response['curve']
+            return response
+        if method != 'GET':
+            raise RequestError(405, f"{method} is not supported on {url.path}.")
+        if url.path == '/strategies':
+            return {stage['module']: {'name': importlib.import_module(stage['module']).strategy_name,
+                                      'params': run_parameters(importlib.import_module(stage['module']).run)}
+                    for stage in strategies.values()}
+        if url.path == '/stats':
+            return {'cached': len(self.cache.entries), 'cache_size': self.cache.size, 'hits': self.cache.hits,
+                    'misses': self.cache.misses, 'running': len(self.pending), 'jobs': self.jobs}
+        raise RequestError(404, f"No such path {url.path}.")
+
+    # One request per connection: read it, answer it and close the connection
+    async def handle(self, reader, writer):
+        try:
+            try:
+                method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > max_body_bytes:
+                    raise RequestError(413, f"The request body is larger than {max_body_bytes} bytes.")
+                body = await reader.readexactly(length) if length else b''
+            except (ValueError, asyncio.IncompleteReadError) as e:
+                raise RequestError(400, f"Malformed request: {e}") from e
+            status, payload = 200, await self.route(method, target, body)
+        except RequestError as e:
+            status, payload = e.status, {'error': str(e)}
+        except Exception as e:
+            traceback.print_exc()
+            status, payload = 500, {'error': f"Internal error ({type(e).__name__}); see the server's log."}
+
+        data = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} {reasons[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    # Serve on localhost:http_port (None to skip) and on a Unix socket at socket_path (None to skip) until stopped
+    async def serve(self, http_port=port, socket_path=None, warm=True):
+        await self.start_workers()
+        servers = []
+        try:
+            if http_port is not None:
+                servers.append(await asyncio.start_server(self.handle, host, http_port))
+                print(f"Serving backtests on http://{host}:{http_port}", flush=True)
+            if socket_path is not None:
+                if os.path.exists(socket_path):
+                    os.remove(socket_path)
+                servers.append(await asyncio.start_unix_server(self.handle, socket_path))
+                os.chmod(socket_path, 0o600)
+                print(f"Serving backtests on the Unix socket {socket_path}", flush=True)
+            if warm:
+                await self.warm_up()
+            await asyncio.gather(*(server.serve_forever() for server in servers))
+        finally:
+            for server in servers:
+                server.close()
+            if socket_path is not None and os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.executor.shutdown(cancel_futures=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve strategy backtests from data kept in memory.")
+    parser.add_argument('--port', type=int, default=port, help=f"HTTP port on {host}")
+    parser.add_argument('--no-http', action='store_true', help="Serve only on the Unix socket")
+    parser.add_argument('--socket', help="Also serve on a Unix socket at this path, e.g. backtest.sock")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument('--cache-size', type=int, default=cache_size, help="Results kept in the cache")
+    parser.add_argument('--price-dtype', choices=['float64', 'float32'], default=PriceData.price_dtype,
+                        help="Precision of the price panel")
+    parser.add_argument('--no-warm', action='store_true', help="Do not run every strategy once at startup")
+    args = parser.parse_args()
+    if args.no_http and not args.socket:
+        parser.error("--no-http needs --socket.")
+
+    server = BacktestServer(Dataset(price_dtype=args.price_dtype), args.jobs, args.cache_size)
+    try:
+        asyncio.run(server.serve(None if args.no_http else args.port, args.socket, not args.no_warm))
+    except KeyboardInterrupt:
+        print("Stopped.")
@@ -0,0 +1,153 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from PriceData import Dataset
+from Analytics import annualization_factor
+from ResultsStore import load_runs
+
+# Defaults of the stationary block bootstrap
+num_resamples = 2000
+block_length = 20  # Mean length, in trading days, of the resampled blocks
+chunk_size = 250  # Resamples generated at once; bounds memory at chunk_size x days x strategies
+confidence = 0.95
+benchmark = 'Buy-and-Hold'
+
+
+# Daily returns of every strategy on the dates they all have, as a days x strategies matrix
+def aligned_returns(data):
+    names = data['Strategy'].unique()
+    data = data.sort_values(['Strategy', 'Date'], kind='stable')
+    returns = data['Money'] / data.groupby('Strategy', sort=False)['Money'].shift() - 1
+    matrix = pd.DataFrame({'Date': data['Date'], 'Strategy': data['Strategy'], 'Return': returns}).pivot_table(
+        index='Date', columns='Strategy', values='Return', aggfunc='last', sort=False)
+    return matrix[names].sort_index().dropna()
+
+
+# Calendar years the aligned returns span, measured as Analytics measures a curve: from the date before the
+# first return (the row it is taken from) to the date of the last
+def return_years(data, returns):
+    dates = np.unique(pd.to_datetime(data['Date']).to_numpy())
+    start = dates[max(dates.searchsorted(returns.index[0].to_datetime64()) - 1, 0)]
+    return (returns.index[-1].to_datetime64() - start) / np.timedelta64(1, 'D') / 365.25
+
+
+# CAGR and Sharpe ratio along axis -2, as Analytics defines them: the growth annualized over the calendar
+# years the returns span, and the CAGR over the annualized volatility. A resample keeps the sample's years.
+def annualized_stats(returns, years):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cagr = np.exp(np.log1p(returns).sum(axis=-2) / years) - 1
+        volatility = returns.std(axis=-2, ddof=1) * np.sqrt(annualization_factor)
+        sharpe = np.where(volatility != 0, cagr / volatility, np.nan)
+    return cagr, sharpe
+
+
+# Row indices of stationary block-bootstrap resamples (Politis and Romano): each day starts a new
+# block at a random day with probability 1 / block_length, and otherwise continues the current
+# block, wrapping around the end of the sample
+def stationary_bootstrap_indices(rng, resamples, days, block_length):
+    starts = rng.integers(0, days, size=(resamples, days))
+    new_block = rng.random((resamples, days)) < 1 / block_length
+    new_block[:, 0] = True
+
+    steps = np.arange(days)
+    block_start = np.maximum.accumulate(np.where(new_block, steps, 0), axis=1)
+    return (np.take_along_axis(starts, block_start, axis=1) + steps - block_start) % days
+
+
+# Statistics of one chunk of resamples: CAGR and Sharpe of every strategy in every resample, and
+# the reality-check statistic of every resample (the best recentred mean excess return over the benchmark)
+def resample_chunk(returns, years, benchmark_column, resamples, block_length, seed):
+    rng = np.random.default_rng(seed)
+    days = returns.shape[0]
+    resampled = returns[stationary_bootstrap_indices(rng, resamples, days, block_length)]
+    cagr, sharpe = annualized_stats(resampled, years)
+
+    excess = resampled - resampled[:, :, [benchmark_column]]
+    mean_excess = excess.mean(axis=1) - (returns - returns[:, [benchmark_column]]).mean(axis=0)
+    others = np.arange(returns.shape[1]) != benchmark_column
+    reality_check = np.sqrt(days) * mean_excess[:, others].max(axis=1, initial=-np.inf)
+    return cagr, sharpe, reality_check
+
+
+# Resample in chunks, spread across processes. Every chunk has its own seed spawned from 'seed',
+# so the results do not depend on the number of processes.
+def bootstrap(returns, years, benchmark_column, resamples=num_resamples, block_length=block_length,
+              chunk_size=chunk_size, jobs=os.cpu_count(), seed=0):
+    sizes = [min(chunk_size, resamples - start) for start in range(0, resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    arguments = [(returns, years, benchmark_column, size, block_length, chunk_seed)
+                 for size, chunk_seed in zip(sizes, seeds)]
+
+    if jobs <= 1 or len(sizes) <= 1:
+        chunks = [resample_chunk(*chunk_arguments) for chunk_arguments in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(sizes))) as executor:
+            chunks = list(executor.map(resample_chunk, *zip(*arguments)))
+
+    cagr, sharpe, reality_check = (np.concatenate(parts) for parts in zip(*chunks))
+    return cagr, sharpe, reality_check
+
+
+# Confidence intervals of each strategy's CAGR and Sharpe ratio, and White's reality check of whether
+# the best strategy beats the benchmark once every strategy tried is taken into account. Every strategy is
+# measured over the dates all of them have, so its point estimates match the metrics report when its curve
+# covers those dates; a longer curve is reported here over the common dates only.
+def run(dataset, strategies=None, run_ids=None, benchmark=benchmark, resamples=num_resamples,
+        block_length=block_length, chunk_size=chunk_size, confidence=confidence, jobs=os.cpu_count(), seed=0,
+        output_file='strategy_significance.csv'):
+    # Load only the requested runs from the results store
+    data = load_runs(run_ids, strategies)
+    returns = aligned_returns(data)
+    if benchmark not in returns.columns:
+        raise ValueError(f"Benchmark '{benchmark}' is not among the loaded runs.")
+    names = returns.columns
+    benchmark_column = names.get_loc(benchmark)
+    values = returns.to_numpy()
+    years = return_years(data, returns)
+
+    cagr, sharpe, reality_check = bootstrap(values, years, benchmark_column, resamples, block_length, chunk_size, jobs, seed)
+    point_cagr, point_sharpe = annualized_stats(values, years)
+
+    tail = (1 - confidence) / 2 * 100
+    lower_cagr, upper_cagr = np.nanpercentile(cagr, [tail, 100 - tail], axis=0)
+    lower_sharpe, upper_sharpe = np.nanpercentile(sharpe, [tail, 100 - tail], axis=0)
+    intervals = pd.DataFrame({
+        'CAGR': point_cagr, 'CAGR Lower': lower_cagr, 'CAGR Upper': upper_cagr,
+        'Sharpe Ratio': point_sharpe, 'Sharpe Lower': lower_sharpe, 'Sharpe Upper': upper_sharpe,
+    }, index=pd.Index(names, name='Strategy'))
+
+    # Reality check: the best observed mean excess return against the bootstrap distribution of the best one
+    mean_excess = (values - values[:, [benchmark_column]]).mean(axis=0)
+    others = np.arange(len(names)) != benchmark_column
+    statistic = np.sqrt(len(values)) * mean_excess[others].max(initial=-np.inf)
+    p_value = np.mean(reality_check >= statistic)
+    best = names[others][np.argmax(mean_excess[others])] if others.any() else None
+
+    print(f"Bootstrap of {len(values)} common trading days, {resamples} resamples, mean block length {block_length}:")
+    print(intervals)
+    print(f"Reality check against {benchmark}: best strategy {best}, p-value {p_value:.4f}")
+
+    intervals.to_csv(output_file)
+    print(f"Confidence intervals saved to '{output_file}'.")
+    return intervals, {'benchmark': benchmark, 'best': best, 'statistic': statistic, 'p_value': p_value}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bootstrap confidence intervals and a reality check for saved strategy runs.")
+    parser.add_argument('--strategies', help="Comma-separated strategy names; defaults to every strategy")
+    parser.add_argument('--runs', help="Comma-separated run ids; defaults to the latest run of each strategy")
+    parser.add_argument('--benchmark', default=benchmark)
+    parser.add_argument('--resamples', type=int, default=num_resamples)
+    parser.add_argument('--block-length', type=float, default=block_length)
+    parser.add_argument('--chunk-size', type=int, default=chunk_size)
+    parser.add_argument('--confidence', type=float, default=confidence)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(Dataset(),
+        strategies=args.strategies.split(',') if args.strategies else None,
+        run_ids=args.runs.split(',') if args.runs else None,
+        benchmark=args.benchmark, resamples=args.resamples, block_length=args.block_length,
+        chunk_size=args.chunk_size, confidence=args.confidence, jobs=args.jobs, seed=args.seed)
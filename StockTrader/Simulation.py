@@ -0,0 +1,55 @@
+import numpy as np
+from Instrumentation import count
+
+# Trade arrays below are days x slots: each row holds one day's trades in the order the
+# strategy places them (symbol order, or rank order for WorstPerDay). 'returns' is the
+# one-day return of each trade and 'traded' marks the slots where a trade actually happens.
+# Both kernels return the money after each day and the money put into that day's trades.
+
+
+# Each trade stakes investment_fraction of the money as it stands when the trade is placed, so
+# the money is multiplied by (1 + investment_fraction * return) after every trade. The day's
+# multiplier is the product of those factors and the curve is their running product.
+def compound_sequential_trades(returns, traded, investment_fraction, initial_money):
+    factors = np.where(traded, 1 + investment_fraction * returns, 1.0)
+    day_multiplier = np.prod(factors, axis=1)
+    money = initial_money * np.cumprod(day_multiplier)
+
+    # Each stake is investment_fraction of the money left after the day's earlier trades
+    factors_before = np.cumprod(np.hstack([np.ones((len(factors), 1)), factors[:, :-1]]), axis=1)
+    start_money = np.concatenate([[initial_money], money])[:-1]
+    traded_value = start_money * investment_fraction * np.where(traded, factors_before, 0.0).sum(axis=1)
+    count('days_simulated', len(money))
+    count('trades', traded.sum())
+    return money, traded_value
+
+
+# Every trade of a day stakes the same amount, investment_fraction of the money at the start of
+# the day, and a trade is skipped when the money left before it is below that stake.
+# Measured in units of the day's starting money, the level before each trade does not depend on
+# the money itself, so the skip rule can be checked for all days at once; only the (rare) days
+# where a skip actually happens are replayed trade by trade.
+def compound_fixed_stake_trades(returns, traded, investment_fraction, initial_money):
+    gains = np.where(traded, investment_fraction * returns, 0.0)
+    level_before = 1 + np.cumsum(gains, axis=1) - gains
+    day_multiplier = 1 + gains.sum(axis=1)
+    trades_made = traded.sum(axis=1)
+
+    replayed_days = np.flatnonzero((traded & (level_before < investment_fraction)).any(axis=1))
+    for day in replayed_days:
+        level = 1.0
+        trades_made[day] = 0
+        for slot in np.flatnonzero(traded[day]):
+            if level < investment_fraction:
+                continue
+            level += gains[day, slot]
+            trades_made[day] += 1
+        day_multiplier[day] = level
+
+    money = initial_money * np.cumprod(day_multiplier)
+    start_money = np.concatenate([[initial_money], money])[:-1]
+    count('days_simulated', len(money))
+    count('trades', trades_made.sum())
+    count('skipped_trades', traded.sum() - trades_made.sum())
+    count('replayed_days', len(replayed_days))
+    return money, start_money * investment_fraction * trades_made
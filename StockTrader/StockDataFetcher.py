@@ -1,77 +1,353 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+import numpy as np
 import pandas as pd
-import yfinance as yf
 import requests
 from bs4 import BeautifulSoup
 import os
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PriceData import Dataset, build_price_panel, write_price_cache
 
-# Step 1: Fetch DJIA constituents from Wikipedia
-wiki_url = "https://en.wikipedia.org/wiki/Dow_Jones_Industrial_Average"
-response = requests.get(wiki_url)
-soup = BeautifulSoup(response.text, 'html.parser')
-
-# Find the table with DJIA constituents
-table = soup.find('table', {'class': 'wikitable'})
-
-# Parse the table to get stock symbols and company names
-djia_data = []
-for row in table.find_all('tr')[1:]:
-    columns = row.find_all('td')
-    if columns:
-        symbol = columns[1].text.strip()
-        company_name = columns[0].text.strip()
-        djia_data.append({'Symbol': symbol, 'Company': company_name})
-
-# Convert to DataFrame and save to CSV
-djia_df = pd.DataFrame(djia_data)
-djia_df.to_csv('djia_constituents.csv', index=False)
-print("DJIA constituents saved to 'djia_constituents.csv'.")
-
-# Step 2 & 3: Fetch 10 years of daily adjusted close prices and save to CSV
-end_date = datetime.today().strftime('%Y-%m-%d')  # Today’s date in 'YYYY-MM-DD' format
-start_date = (datetime.today() - timedelta(days=365*10)).strftime('%Y-%m-%d')  # 10 years ago
 data_dir = "djia_stock_data"
-os.makedirs(data_dir, exist_ok=True)
+manifest_file = "manifest.json"
 
-for index, row in djia_df.iterrows():
-    symbol = row['Symbol']
-    company = row['Company']
+# Downloads are network-bound, so a small thread pool is enough to overlap them
+default_workers = 8
+default_retries = 3
+default_backoff = 1.0  # Seconds before the first retry, doubled on every further attempt
+
+# Symbols of a synthetic universe are this prefix and a number
+synthetic_prefix = 'SYN'
+
+# Workers share one manifest; updates to it are serialized
+manifest_lock = threading.Lock()
+
+
+# Download source backed by Yahoo Finance.
+# yf.download keeps its results in module-level state and is not safe to call from several
+# threads at once, so each request goes through its own Ticker instead.
+class YFinanceSource:
+    def download(self, symbol, start, end):
+        import yfinance as yf
+        stock_data = yf.Ticker(symbol).history(start=start, end=end, auto_adjust=False, actions=False)
+        stock_data.index = stock_data.index.tz_localize(None)  # Same naive dates yf.download returns
+        return stock_data
+
+
+# Offline stand-in for yfinance that serves {directory}/{symbol}.csv files with a 'Date' column.
+# Like yfinance, 'start' is inclusive and 'end' is exclusive.
+class LocalFileSource:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def download(self, symbol, start, end):
+        stock_data = pd.read_csv(os.path.join(self.directory, f"{symbol}.csv"), parse_dates=['Date'])
+        in_range = (stock_data['Date'] >= pd.Timestamp(start)) & (stock_data['Date'] < pd.Timestamp(end))
+        return stock_data[in_range].set_index('Date')
+
+
+# Offline source of random-walk prices for a synthetic universe of symbols SYN0000, SYN0001, ...
+# Each symbol's series is fixed by the seed and its number. Some symbols list after the first date
+# or delist before the last one, and a few rows are missing, so histories are as ragged as real ones.
+class SyntheticSource:
+    calendar_start = '2000-01-03'
+
+    def __init__(self, seed=0, num_days=252 * 30, missing_rate=0.005):
+        self.seed = seed
+        self.dates = pd.bdate_range(self.calendar_start, periods=num_days)
+        self.missing_rate = missing_rate  # Share of rows dropped at random inside each history
+
+    def download(self, symbol, start, end):
+        rng = np.random.default_rng([self.seed, int(symbol[len(synthetic_prefix):])])
+        num_days = len(self.dates)
+        prices = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, num_days)))
+
+        # Listing and delisting dates, and scattered missing rows
+        listed = np.ones(num_days, dtype=bool)
+        if rng.random() < 0.3:
+            listed[:rng.integers(num_days // 2)] = False
+        if rng.random() < 0.2:
+            listed[num_days // 2 + rng.integers(num_days // 2):] = False
+        listed &= rng.random(num_days) >= self.missing_rate
+
+        in_range = listed & (self.dates >= pd.Timestamp(start)) & (self.dates < pd.Timestamp(end))
+        volume = rng.integers(10_000, 1_000_000, num_days)
+        return pd.DataFrame({
+            'Open': prices, 'High': prices, 'Low': prices, 'Close': prices, 'Adj Close': prices, 'Volume': volume,
+        }, index=pd.DatetimeIndex(self.dates, name='Date'))[in_range]
+
+
+def synthetic_constituents(num_symbols):
+    symbols = [f"{synthetic_prefix}{k:04d}" for k in range(num_symbols)]
+    return pd.DataFrame({'Symbol': symbols, 'Company': [f"Synthetic {symbol}" for symbol in symbols]})
+
+
+# Fetch DJIA constituents from Wikipedia
+def fetch_djia_constituents():
+    wiki_url = "https://en.wikipedia.org/wiki/Dow_Jones_Industrial_Average"
+    response = requests.get(wiki_url)
+    soup = BeautifulSoup(response.text, 'html.parser')
+
+    # Find the table with DJIA constituents
+    table = soup.find('table', {'class': 'wikitable'})
+
+    # Parse the table to get stock symbols and company names
+    djia_data = []
+    for row in table.find_all('tr')[1:]:
+        columns = row.find_all('td')
+        if columns:
+            symbol = columns[1].text.strip()
+            company_name = columns[0].text.strip()
+            djia_data.append({'Symbol': symbol, 'Company': company_name})
+
+    return pd.DataFrame(djia_data)
+
+
+# Fetch S&P 500 constituents from Wikipedia
+def fetch_sp500_constituents():
+    wiki_url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
+    response = requests.get(wiki_url, headers={'User-Agent': 'Mozilla/5.0'})
+    soup = BeautifulSoup(response.text, 'html.parser')
+
+    # The constituents table comes first; symbols are in the first column and names in the second
+    table = soup.find('table', {'id': 'constituents'})
+
+    sp500_data = []
+    for row in table.find_all('tr')[1:]:
+        columns = row.find_all('td')
+        if columns:
+            # Yahoo Finance writes share classes with a dash (BRK-B), Wikipedia with a dot (BRK.B)
+            symbol = columns[0].text.strip().replace('.', '-')
+            company_name = columns[1].text.strip()
+            sp500_data.append({'Symbol': symbol, 'Company': company_name})
+
+    return pd.DataFrame(sp500_data)
+
+
+index_constituents = {'djia': fetch_djia_constituents, 'sp500': fetch_sp500_constituents}
+
+
+# The symbols to fetch and the source to fetch them from, for a universe given as
+#   'djia' or 'sp500'          the index constituents, scraped from Wikipedia
+#   'tickers:AAPL,MSFT,...'    a list of tickers
+#   'synthetic:500'            500 synthetic symbols (served offline; see SyntheticSource)
+# A constituents CSV or a local source directory, when given, take precedence.
+def resolve_universe(universe='djia', constituents=None, source_dir=None, seed=0):
+    kind, _, argument = universe.partition(':')
+    if kind == 'synthetic':
+        djia_df = synthetic_constituents(int(argument))
+        source = SyntheticSource(seed)
+    else:
+        if kind == 'tickers':
+            symbols = [symbol.strip().upper() for symbol in argument.split(',') if symbol.strip()]
+            djia_df = pd.DataFrame({'Symbol': symbols, 'Company': symbols})
+        elif kind in index_constituents:
+            djia_df = index_constituents[kind]()
+        else:
+            raise ValueError(f"Unknown universe '{universe}'. Use djia, sp500, tickers:A,B,... or synthetic:N.")
+        source = YFinanceSource()
+
+    if constituents:
+        djia_df = pd.read_csv(constituents)
+    if source_dir:
+        source = LocalFileSource(source_dir)
+    return djia_df, source
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(directory=data_dir):
     try:
-        # Download stock data using yfinance
-        stock_data = yf.download(symbol, start=start_date, end=end_date)
+        with open(os.path.join(directory, manifest_file)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+# Rewrite the manifest atomically so an interrupted run never leaves it half-written
+def save_manifest(manifest, directory=data_dir):
+    path = os.path.join(directory, manifest_file)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+# Download through the source, retrying failed requests with exponential backoff
+def download_with_retry(source, symbol, start, end, retries=default_retries, backoff=default_backoff):
+    for attempt in range(retries + 1):
+        try:
+            return source.download(symbol, start=start, end=end)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"Download of {symbol} failed ({e}). Retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
 
-        # Explicitly add the 'Date' column from the index
-        stock_data['Date'] = stock_data.index
+# Decide whether a symbol's file can be extended: it must exist, match its recorded checksum
+# and already start at or before the requested start date
+def is_resumable(entry, path, start_date):
+    if entry is None or not os.path.isfile(path):
+        return False
+    if entry['start'] > start_date:
+        return False
+    return file_checksum(path) == entry['sha256']
 
-        # Add company and symbol columns
-        stock_data['Company'] = company
-        stock_data['Symbol'] = symbol
 
+# Bring one symbol's CSV up to end_date, downloading only the dates it does not cover yet.
+# Returns the number of new rows written.
+def update_symbol(source, symbol, company, start_date, end_date, manifest, directory=data_dir,
+                  retries=default_retries, backoff=default_backoff):
+    path = f'{directory}/{symbol}.csv'
+    with manifest_lock:
+        entry = manifest.get(symbol)
+    resume = is_resumable(entry, path, start_date)
+
+    # Request only the missing tail of the series
+    fetch_start = start_date
+    if resume:
+        fetch_start = (pd.Timestamp(entry['end']) + timedelta(days=1)).strftime('%Y-%m-%d')
+        if fetch_start >= end_date:
+            return 0
+
+    stock_data = download_with_retry(source, symbol, fetch_start, end_date, retries, backoff)
+
+    # Explicitly add the 'Date' column from the index
+    stock_data['Date'] = stock_data.index
+
+    # Add company and symbol columns
+    stock_data['Company'] = company
+    stock_data['Symbol'] = symbol
+
+    if resume:
+        # Append the new rows with the column order already in the file
+        header = pd.read_csv(path, nrows=0).columns
+        stock_data = stock_data[stock_data['Date'] > pd.Timestamp(entry['end'])]
+        stock_data[header].to_csv(path, mode='a', header=False, index=False)
+        covered_start = entry['start']
+        rows = entry['rows'] + len(stock_data)
+    else:
         # Save the data to a CSV file
-        stock_data.to_csv(f'{data_dir}/{symbol}.csv', index=False)  # Overwrite each file
-        print(f"Data for {symbol} saved successfully.")
-    except Exception as e:
-        print(f"Error fetching data for {symbol}: {e}")
+        stock_data.to_csv(path, index=False)  # Overwrite each file
+        covered_start = start_date
+        rows = len(stock_data)
+
+    # The series is covered up to the last date downloaded, or up to its previous coverage if nothing was new
+    if len(stock_data):
+        last_date = pd.Timestamp(stock_data['Date'].max()).strftime('%Y-%m-%d')
+    elif resume:
+        last_date = entry['end']
+    else:
+        return 0
+
+    # Record the new coverage only once the file is complete, so an interrupted run resumes from here
+    checksum = file_checksum(path)
+    with manifest_lock:
+        manifest[symbol] = {'start': covered_start, 'end': last_date, 'rows': rows, 'sha256': checksum}
+        save_manifest(manifest, directory)
+    return len(stock_data)
 
-# Step 4: Load the constituent symbols and price data from the CSV files
-all_data = pd.DataFrame()
 
-for index, row in djia_df.iterrows():
-    symbol = row['Symbol']
-    company = row['Company']
+# Step 2 & 3: Fetch daily prices for every constituent through a bounded worker pool,
+# resuming from what is already on disk
+def fetch_all(djia_df, source, start_date, end_date, directory=data_dir, workers=default_workers,
+              retries=default_retries, backoff=default_backoff):
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(update_symbol, source, row['Symbol'], row['Company'], start_date, end_date,
+                            manifest, directory, retries, backoff): row['Symbol']
+            for _, row in djia_df.iterrows()
+        }
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                new_rows = future.result()
+                print(f"Data for {symbol} saved successfully ({new_rows} new rows).")
+            except Exception as e:
+                print(f"Error fetching data for {symbol}: {e}")
+
+
+# Read one symbol's CSV, restricted to the backtest window
+def read_symbol_file(symbol, company, start_date, directory=data_dir):
     try:
-        stock_df = pd.read_csv(f'{data_dir}/{symbol}.csv', parse_dates=['Date'])  # Ensure 'Date' is parsed as datetime
-        stock_df['Company'] = company  # Add company name column if missing
-        stock_df['Symbol'] = symbol  # Add symbol column if missing
-        all_data = pd.concat([all_data, stock_df], axis=0)  # Combine all data
+        stock_df = pd.read_csv(f'{directory}/{symbol}.csv', parse_dates=['Date'])  # Ensure 'Date' is parsed as datetime
     except FileNotFoundError:
         print(f"Data file for {symbol} not found.")
+        return None
     except Exception as e:
         print(f"Error processing data for {symbol}: {e}")
+        return None
+
+    stock_df = stock_df[stock_df['Date'] >= pd.Timestamp(start_date)]  # Older rows kept from earlier runs fall outside the window
+    stock_df['Company'] = company  # Add company name column if missing
+    stock_df['Symbol'] = symbol  # Add symbol column if missing
+    return stock_df
+
+
+# Step 4: Load the constituent symbols and price data from the CSV files in parallel
+def assemble_all_data(djia_df, start_date, directory=data_dir, workers=default_workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        frames = list(executor.map(lambda row: read_symbol_file(row[0], row[1], start_date, directory),
+                                   zip(djia_df['Symbol'], djia_df['Company'])))
+
+    # Combine all data in a single concatenation, grouped by symbol in sorted order
+    all_data = pd.concat([frame for frame in frames if frame is not None], axis=0, ignore_index=True)
+    all_data = all_data.sort_values('Symbol', kind='stable', ignore_index=True)
+
+    # Step 5: Handle missing data using a group-wise forward fill
+    filled = all_data.groupby('Symbol', sort=False).ffill()
+    all_data[filled.columns] = filled
+    return all_data
+
+
+# Fetch the universe's daily adjusted close prices for the last 'years' years and rebuild the combined dataset.
+# Symbols that list or delist inside the window keep just the rows they have; the price panel's validity
+# mask marks where each symbol has data, so nothing is dropped or back-filled.
+def run(dataset, source_dir=None, constituents=None, workers=default_workers, universe='djia', years=10):
+    # Step 1: Get the symbols of the universe (the DJIA constituents from Wikipedia by default)
+    djia_df, source = resolve_universe(universe, constituents, source_dir)
+    if not constituents:
+        djia_df.to_csv('djia_constituents.csv', index=False)
+        print(f"{len(djia_df)} constituents saved to 'djia_constituents.csv'.")
+
+    end_date = datetime.today().strftime('%Y-%m-%d')  # Today’s date in 'YYYY-MM-DD' format
+    start_date = (datetime.today() - timedelta(days=round(365 * years))).strftime('%Y-%m-%d')
+    fetch_all(djia_df, source, start_date, end_date, workers=workers)
+
+    all_data = assemble_all_data(djia_df, start_date, workers=workers)
+
+    # Save the combined data to a CSV file (overwrite by default)
+    all_data.to_csv(dataset.price_csv_file, index=False)
+    print(f"All price data saved to '{dataset.price_csv_file}'.")
+
+    # Step 6: Refresh the binary price cache so the strategies can skip parsing the CSV
+    write_price_cache(build_price_panel(all_data, price_dtype=dataset.price_dtype), dataset.price_csv_file, cache_dir=dataset.cache_dir)
+    dataset.reload()
+    print("Price cache refreshed.")
+    return all_data
+
 
-# Step 5: Handle missing data using forward fill
-all_data = all_data.groupby('Symbol').apply(lambda x: x.fillna(method='ffill')).reset_index(drop=True)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fetch daily prices for a universe of stocks, downloading only what is missing.")
+    parser.add_argument('--universe', default='djia', help="djia, sp500, tickers:AAPL,MSFT,... or synthetic:N")
+    parser.add_argument('--years', type=float, default=10, help="Years of history to fetch")
+    parser.add_argument('--source-dir', help="Read prices from {symbol}.csv files in this directory instead of Yahoo Finance")
+    parser.add_argument('--constituents', help="Use this constituents CSV (Symbol, Company) instead of the universe's list")
+    parser.add_argument('--workers', type=int, default=default_workers, help="Number of concurrent downloads")
+    args = parser.parse_args()
 
-# Save the combined data to a CSV file (overwrite by default)
-all_data.to_csv('djia_all_data.csv', index=False)
-print("All DJIA data saved to 'djia_all_data.csv'.")
+    run(Dataset(), args.source_dir, args.constituents, args.workers, args.universe, args.years)
@@ -0,0 +1,329 @@
+import operator
+import numpy as np
+import pandas as pd
+import Portfolio
+from Instrumentation import ProgressReporter, count
+from Portfolio import equal_weights, simulate_portfolio
+from Ranking import bottom_k, top_k
+from Simulation import compound_fixed_stake_trades, compound_sequential_trades
+
+# Declarative strategies. A strategy subclasses Strategy and declares, as class attributes:
+#   universe         stocks it may trade on each date; by default every stock with a row on the date
+#   signal           stocks it buys on each date, e.g. price < sma(param('lookback_period')) * 0.95; None buys the universe
+#   rank_by, rank    a value to rank the signalled stocks by, 'lowest' or 'highest' first, and
+#   max_positions    how many of the top ranked stocks to buy; without rank_by every signalled stock is bought
+#   sizing           'compound': each trade stakes investment_fraction of the money as it stands when placed;
+#                    'fixed_stake': each trade stakes investment_fraction of the day's starting money;
+#                    'equal_weight': the money is split equally over the picked stocks and held as a portfolio
+#                    (see Portfolio), or, with holding_period None, the initial money over every stock
+#   holding_period   trading days a position is held before it is sold at the close; new positions are opened
+#                    once the previous ones are sold. None holds every stock until its history ends.
+#   transaction_cost_bps, slippage_bps, cash_return
+#                    trading costs and the return of the cash, for 'equal_weight' portfolios
+# Signals are expressions over the whole panel: price, listed, returns(h), sma(window) and param(name) combined
+# with arithmetic, comparisons, & | ~ and abs(). Each one evaluates to a dates x symbols array in one operation,
+# so the engine never loops over stocks, and the simulation compounds all dates at once (see Simulation).
+
+rankings = {'lowest': bottom_k, 'highest': top_k}
+simulations = {'compound': compound_sequential_trades, 'fixed_stake': compound_fixed_stake_trades}
+
+
+# Values of the expressions of one run, each computed once however often it appears
+class Context:
+    def __init__(self, dataset, params):
+        self.dataset = dataset
+        self.params = params
+        self.values = {}
+
+    def value(self, operand):
+        if not isinstance(operand, Expression):
+            return operand
+        if operand.key not in self.values:
+            self.values[operand.key] = operand.evaluate(self)
+        return self.values[operand.key]
+
+
+class Expression:
+    key = None
+
+    def evaluate(self, context):
+        raise NotImplementedError
+
+    # Rows at the start of the panel on which the expression is not yet meaningful
+    def warmup(self, context):
+        return 0
+
+    def __add__(self, other): return Operation(operator.add, self, other)
+    def __radd__(self, other): return Operation(operator.add, other, self)
+    def __sub__(self, other): return Operation(operator.sub, self, other)
+    def __rsub__(self, other): return Operation(operator.sub, other, self)
+    def __mul__(self, other): return Operation(operator.mul, self, other)
+    def __rmul__(self, other): return Operation(operator.mul, other, self)
+    def __truediv__(self, other): return Operation(operator.truediv, self, other)
+    def __rtruediv__(self, other): return Operation(operator.truediv, other, self)
+    def __lt__(self, other): return Operation(operator.lt, self, other)
+    def __le__(self, other): return Operation(operator.le, self, other)
+    def __gt__(self, other): return Operation(operator.gt, self, other)
+    def __ge__(self, other): return Operation(operator.ge, self, other)
+    def __and__(self, other): return Operation(operator.and_, self, other)
+    def __rand__(self, other): return Operation(operator.and_, other, self)
+    def __or__(self, other): return Operation(operator.or_, self, other)
+    def __ror__(self, other): return Operation(operator.or_, other, self)
+    def __invert__(self): return Operation(operator.invert, self)
+    def __neg__(self): return Operation(operator.neg, self)
+    def __abs__(self): return Operation(np.abs, self)
+
+
+def _key(operand):
+    return operand.key if isinstance(operand, Expression) else ('constant', operand)
+
+
+# An operator applied to expressions and constants, element by element over the panel
+class Operation(Expression):
+    def __init__(self, function, *operands):
+        self.function = function
+        self.operands = operands
+        self.key = (function.__name__, *(_key(operand) for operand in operands))
+
+    def evaluate(self, context):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.function(*(context.value(operand) for operand in self.operands))
+
+    def warmup(self, context):
+        return max((operand.warmup(context) for operand in self.operands if isinstance(operand, Expression)), default=0)
+
+
+# A parameter of the run, e.g. param('lookback_period')
+class Param(Expression):
+    def __init__(self, name):
+        self.name = name
+        self.key = ('param', name)
+
+    def evaluate(self, context):
+        if self.name not in context.params:
+            raise ValueError(f"Strategy parameter '{self.name}' is not set.")
+        return context.params[self.name]
+
+
+# Adjusted close, NaN where there is no row
+class Price(Expression):
+    key = ('price',)
+
+    def evaluate(self, context):
+        return context.dataset.panel.prices
+
+
+# True where the stock has a row on the date
+class Listed(Expression):
+    key = ('listed',)
+
+    def evaluate(self, context):
+        return context.dataset.panel.valid
+
+
+# Return over the stock's last 'horizon' rows, from the returns store
+class Returns(Expression):
+    def __init__(self, horizon):
+        self.horizon = horizon
+        self.key = ('returns', horizon)
+
+    def evaluate(self, context):
+        return context.dataset.returns[f'return_{self.horizon}d']
+
+    def warmup(self, context):
+        return self.horizon
+
+
+# Mean of the stock's last 'window' prices, NaN until it has that many rows (see Indicators)
+class SMA(Expression):
+    def __init__(self, window):
+        self.window = window
+        self.key = ('sma', _key(window))
+
+    def evaluate(self, context):
+        return context.dataset.indicators(int(context.value(self.window))).mean
+
+    def warmup(self, context):
+        return int(context.value(self.window))
+
+
+price = Price()
+listed = Listed()
+
+
+def param(name):
+    return Param(name)
+
+
+def returns(horizon=1):
+    return Returns(horizon)
+
+
+def sma(window):
+    return SMA(window)
+
+
+# Return from each date's close to the close 'holding_period' rows later, where both rows exist
+def forward_returns(dataset, holding_period):
+    if holding_period == 1:
+        return dataset.returns['forward_return_1d']
+    prices, valid = dataset.panel.prices, dataset.panel.valid
+    forward = np.full(prices.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        forward[:-holding_period] = np.where(valid[:-holding_period] & valid[holding_period:],
+                                             prices[holding_period:] / prices[:-holding_period] - 1, np.nan)
+    return forward
+
+
+# Rows on which positions are opened: candidate rows at least holding_period apart whose positions are sold
+# by the last candidate row
+def trading_rows(candidate_rows, holding_period):
+    rows = []
+    for row in candidate_rows:
+        if row + holding_period > candidate_rows[-1]:
+            break
+        if not rows or row >= rows[-1] + holding_period:
+            rows.append(row)
+    return np.array(rows, dtype=int)
+
+
+class Strategy:
+    name = None
+    universe = listed
+    signal = None
+    rank_by = None
+    rank = 'lowest'
+    max_positions = None
+    sizing = 'compound'
+    investment_fraction = 0.10
+    holding_period = 1
+    transaction_cost_bps = Portfolio.transaction_cost_bps
+    slippage_bps = Portfolio.slippage_bps
+    cash_return = Portfolio.cash_return
+
+    # Declarations can be overridden for one instance, e.g. WorstPerDayStrategy(rank='highest')
+    def __init__(self, **declarations):
+        for name, value in declarations.items():
+            if not hasattr(type(self), name):
+                raise TypeError(f"Strategy has no declaration '{name}'.")
+            setattr(self, name, value)
+
+    # Money curve of the strategy over the dataset's panel, as a Date, Money, Traded, Strategy frame (with
+    # the Portfolio engine's Turnover, Costs and Cash for 'equal_weight' sizing with a holding period).
+    # 'params' gives the values of the expressions' param() names and the initial_money.
+    def run(self, dataset, **params):
+        context = Context(dataset, params)
+        with np.errstate(invalid='ignore'):
+            eligible = context.value(self.universe)
+            if self.signal is not None:
+                eligible = eligible & context.value(self.signal)
+                count('signals', eligible.sum())
+
+        if self.holding_period is None:
+            if self.sizing != 'equal_weight':
+                raise ValueError(f"Strategy {self.name} holds its stocks to the end; only 'equal_weight' sizing applies.")
+            money_df = self.hold(dataset.panel, eligible, params['initial_money'])
+        elif self.sizing == 'equal_weight':
+            money_df = self.rebalance(context, eligible)
+        elif self.sizing in simulations:
+            money_df = self.trade(context, eligible)
+        else:
+            raise ValueError(f"Strategy {self.name} has unknown sizing '{self.sizing}'; use one of "
+                             f"{', '.join([*simulations, 'equal_weight'])}.")
+
+        # Report a sample of the days' money, if progress reporting is on
+        ProgressReporter(self.name).report(money_df['Date'], money_df['Money'].to_numpy())
+        return money_df.assign(Strategy=self.name)
+
+    # Rows on which positions are opened, and the stocks bought on each: a rows x min(max_positions, symbols)
+    # array of columns in rank order (ties keep symbol order, -1 for an empty slot), or None when every eligible
+    # stock is bought. Without a ranking every date past the warm-up is a candidate; with one, the dates where some
+    # eligible stock can be ranked.
+    def picks(self, context, eligible):
+        warmup = max(expression.warmup(context) for expression in (self.universe, self.signal, self.rank_by)
+                     if isinstance(expression, Expression))
+        if self.rank_by is None:
+            return trading_rows(np.arange(warmup, len(context.dataset.panel.dates)), self.holding_period), None
+
+        key = context.value(self.rank_by)
+        candidate_rows = np.flatnonzero((eligible & ~np.isnan(key)).any(axis=1))
+        rows = trading_rows(candidate_rows[candidate_rows >= warmup], self.holding_period)
+        count('rankings', len(rows))
+        return rows, rankings[self.rank](key[rows], eligible[rows], context.value(self.max_positions))
+
+    # Buy the picked stocks at each trading row's close and sell them holding_period rows later
+    def trade(self, context, eligible):
+        dataset, panel = context.dataset, context.dataset.panel
+        forward = forward_returns(dataset, self.holding_period)
+        rows, picks = self.picks(context, eligible)
+
+        if picks is None:
+            day_traded = (eligible & ~np.isnan(forward))[rows]
+            day_returns = forward[rows]
+        else:
+            selected = picks >= 0
+            day_returns = forward[rows[:, None], np.where(selected, picks, 0)]
+            day_traded = selected & ~np.isnan(day_returns)
+            count('return_lookups', selected.sum())
+
+        money, traded_value = simulations[self.sizing](day_returns, day_traded, context.value(self.investment_fraction),
+                                                       context.value(param('initial_money')))
+        return pd.DataFrame({'Date': panel.dates[rows + self.holding_period], 'Money': money, 'Traded': traded_value})
+
+    # Split the money equally over the stocks picked on each trading row and hold them until the next trading
+    # row, holding_period rows later, where the portfolio is rebalanced into the new picks. The holdings are
+    # valued with the Portfolio engine, which charges the trading costs and keeps the rest in cash.
+    def rebalance(self, context, eligible):
+        dataset, panel = context.dataset, context.dataset.panel
+        rows, picks = self.picks(context, eligible)
+        weights = np.zeros(panel.shape)
+        if picks is None:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                weights[rows] = np.nan_to_num(eligible[rows] / eligible[rows].sum(axis=1, keepdims=True))
+        else:
+            weights[rows] = equal_weights(picks, panel.shape[1])
+
+        money_df = simulate_portfolio(panel.dates, weights, dataset.returns['return_1d'],
+                                      context.value(param('initial_money')), rows,
+                                      context.value(self.transaction_cost_bps), context.value(self.slippage_bps),
+                                      context.value(self.cash_return))
+        # The curve starts on the first trading row
+        return money_df.iloc[rows[0] if len(rows) else len(money_df):].reset_index(drop=True)
+
+    # Invest an equal share of the initial money in every stock on its first eligible date and hold it; until
+    # then its share is held as cash. A stock with no price on a date inside its history is valued at its last
+    # price, and a stock whose history ends before the last date is sold at its last price and held as cash
+    # from then on.
+    def hold(self, panel, eligible, initial_money):
+        all_dates = panel.dates
+        listed_rows = eligible.any(axis=0)
+        first_rows = np.where(listed_rows, np.argmax(eligible, axis=0), -1)
+        last_rows = np.where(listed_rows, len(all_dates) - 1 - np.argmax(eligible[::-1], axis=0), -1)
+
+        investment_per_stock = initial_money / len(panel.symbols)
+        first_day_price = panel.prices[np.maximum(first_rows, 0), np.arange(len(panel.symbols))]
+        shares_owned = np.where(listed_rows, investment_per_stock / first_day_price, 0.0)
+        bought_on_row = np.bincount(first_rows[listed_rows], minlength=len(all_dates))
+        invested_on_row = bought_on_row * investment_per_stock
+        uninvested_cash = (len(panel.symbols) - np.cumsum(bought_on_row)) * investment_per_stock
+
+        # Value the holdings on every date at each stock's last price, from its first row to its last
+        rows = np.arange(len(all_dates))[:, None]
+        last_price_rows = np.maximum.accumulate(np.where(panel.valid, rows, 0), axis=0)
+        last_prices = np.take_along_axis(panel.prices, last_price_rows, axis=0)
+        held = (rows >= first_rows) & (rows <= last_rows)
+        with np.errstate(invalid='ignore'):
+            holdings_value = np.where(held, shares_owned * last_prices, 0.0).sum(axis=1)
+        delisted = np.flatnonzero(listed_rows & (last_rows < len(all_dates) - 1))
+        last_value = shares_owned[delisted] * panel.prices[last_rows[delisted], delisted]
+        delisting_cash = np.bincount(last_rows[delisted] + 1, weights=last_value, minlength=len(all_dates) + 1)
+        money = holdings_value + uninvested_cash + np.cumsum(delisting_cash[:len(all_dates)])
+
+        missing = (~panel.valid & held).sum()
+        count('missing_stock_days', missing)
+        if missing:
+            print(f"Missing price data for {missing} stock-days inside their histories; those stocks are valued at their last price on those days.")
+
+        # The curve starts with the initial money on the first date, followed by the value on every date
+        return pd.DataFrame({'Date': all_dates[:1].append(all_dates), 'Money': np.concatenate([[initial_money], money]),
+                             'Traded': np.concatenate([[0.0], invested_on_row])})
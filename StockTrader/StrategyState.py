@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import numpy as np
+from ResultsStore import results_dir
+
+# Snapshots of a streaming strategy's state, saved next to the run they end as
+# results/<strategy>/<run id>.state.npz. A snapshot holds the stream's state (money, open orders and
+# rolling windows) as flat named arrays, with a JSON header giving the format version, the strategy and
+# parameters, the final date of the run and a checksum of the arrays.
+
+state_version = 2
+state_suffix = '.state.npz'
+
+
+class StateError(Exception):
+    pass
+
+
+def state_path(run_id, strategy_name, directory=results_dir):
+    return os.path.join(directory, strategy_name, f"{run_id}{state_suffix}")
+
+
+# Nested dicts of arrays and scalars to flat 'outer/inner' names; None values are left out
+def flatten_state(state, prefix=''):
+    arrays = {}
+    for name, value in state.items():
+        if isinstance(value, dict):
+            arrays.update(flatten_state(value, f"{prefix}{name}/"))
+        elif value is not None:
+            arrays[f"{prefix}{name}"] = np.asarray(value)
+    return arrays
+
+
+def unflatten_state(arrays):
+    state = {}
+    for name, array in arrays.items():
+        *parents, leaf = name.split('/')
+        level = state
+        for parent in parents:
+            level = level.setdefault(parent, {})
+        level[leaf] = array.item() if array.ndim == 0 else array
+    return state
+
+
+def state_checksum(arrays):
+    digest = hashlib.sha256()
+    for name in sorted(arrays):
+        array = np.ascontiguousarray(arrays[name])
+        digest.update(f"{name}:{array.dtype.str}:{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+# Write a snapshot: 'state' is the stream's state and 'header' describes the run it ends
+def save_snapshot(path, state, header):
+    arrays = flatten_state(state)
+    header = {**header, 'version': state_version, 'checksum': state_checksum(arrays)}
+
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, header=np.array(json.dumps(header, default=str)), **{f"state/{name}": array
+                                                                            for name, array in arrays.items()})
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    with np.load(path, allow_pickle=False) as snapshot:
+        return json.loads(snapshot['header'].item())
+
+
+# Read a snapshot back as (state, header), checking its version and checksum
+def load_snapshot(path):
+    with np.load(path, allow_pickle=False) as snapshot:
+        header = json.loads(snapshot['header'].item())
+        arrays = {name[len('state/'):]: snapshot[name] for name in snapshot.files if name.startswith('state/')}
+
+    if header.get('version') != state_version:
+        raise StateError(f"Snapshot '{path}' has version {header.get('version')}, expected {state_version}.")
+    if state_checksum(arrays) != header['checksum']:
+        raise StateError(f"Snapshot '{path}' does not match its checksum.")
+    return unflatten_state(arrays), header
@@ -0,0 +1,287 @@
+import argparse
+import copy
+import importlib
+import json
+import os
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from PriceData import Dataset, last_valid_rows, open_price_arrays
+from Instrumentation import ProgressReporter, count
+from Simulation import compound_sequential_trades
+from ResultsStore import list_runs, run_parameters, save_strategy_results
+from StrategyState import StateError, load_snapshot, read_header, save_snapshot, state_path
+
+# Streaming backtests replay the price store one date at a time. A strategy's stream() generator takes
+# the bars and yields (date, money, traded) records, keeping only its rolling state between bars, so
+# memory does not grow with the length of the history.
+
+# One date of the price store: the price and row flag of every symbol, in panel column order, and
+# which symbols have their last row (they delist) before the end of the data
+Bar = namedtuple('Bar', ['date', 'prices', 'valid', 'last'])
+
+# Stocks bought at a bar's close: their columns (-1 for an empty slot) and the prices paid
+Orders = namedtuple('Orders', ['columns', 'prices'])
+
+
+# Replay the memory-mapped price store date by date, from start_row on; only the current row is read into memory
+def replay_bars(price_arrays, start_row=0):
+    dates, prices, valid = price_arrays['dates'], price_arrays['prices'], price_arrays['valid']
+    last_rows = last_valid_rows(valid)
+    for row in range(start_row, len(dates)):
+        row_valid = np.array(valid[row])
+        delisting = row_valid & (last_rows == row) & (row < len(dates) - 1)
+        yield Bar(pd.Timestamp(dates[row]), np.array(prices[row]), row_valid, delisting)
+
+
+# The last 'size' observations of each symbol, taken over the symbol's own rows like the batch
+# rolling windows. Every symbol has its own write position, since symbols skip different dates.
+class RingBuffer:
+    def __init__(self, size, width):
+        self.size = size
+        self.values = np.full((size, width), np.nan)
+        self.seen = np.zeros(width, dtype=int)  # Observations pushed for each symbol so far
+
+    # The buffer's arrays, for a snapshot, and a buffer rebuilt from them
+    def state(self):
+        return {'values': self.values, 'seen': self.seen}
+
+    @classmethod
+    def from_state(cls, state):
+        window = cls(*state['values'].shape)
+        window.values, window.seen = state['values'].copy(), state['seen'].copy()
+        return window
+
+    def push(self, columns, values):
+        self.values[self.seen[columns] % self.size, columns] = values
+        self.seen[columns] += 1
+
+    # True for symbols with at least 'size' observations
+    @property
+    def full(self):
+        return self.seen >= self.size
+
+    # Mean of the non-NaN values in each symbol's window
+    def mean(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nansum(self.values, axis=0) / (~np.isnan(self.values)).sum(axis=0)
+
+
+# One-day return of every symbol with a row on the bar, against its previous row, forward-filling
+# missing prices the way the returns store (pct_change) does; NaN where it is undefined
+class DailyReturns:
+    def __init__(self, width):
+        self.last_price = np.full(width, np.nan)
+        self.has_row = np.zeros(width, dtype=bool)
+
+    def state(self):
+        return {'last_price': self.last_price, 'has_row': self.has_row}
+
+    @classmethod
+    def from_state(cls, state):
+        daily_returns = cls(len(state['last_price']))
+        daily_returns.last_price, daily_returns.has_row = state['last_price'].copy(), state['has_row'].copy()
+        return daily_returns
+
+    def update(self, bar):
+        filled = np.where(np.isnan(bar.prices), self.last_price, bar.prices)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.where(bar.valid & self.has_row, filled / self.last_price - 1, np.nan)
+        self.last_price = np.where(bar.valid, filled, self.last_price)
+        self.has_row |= bar.valid
+        return returns
+
+
+# Place orders for the given columns at the bar's closing prices
+def place_orders(columns, bar):
+    return Orders(columns, np.where(columns >= 0, bar.prices[columns], np.nan))
+
+
+# Returns of the orders from the previous bar, sold at this bar's close; NaN where a stock has no
+# row on this bar or there is no order in the slot
+def settle_orders(orders, bar):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((orders.columns >= 0) & bar.valid[orders.columns],
+                        bar.prices[orders.columns] / orders.prices - 1, np.nan)
+
+
+# Stream of a strategy that buys, at each bar's close, the stocks with lookback_period prices for which
+# signal(prices, moving_average) is true, and sells them at the next bar's close; each trade invests
+# investment_fraction of the current money, as the batch 'compound' sizing does. Yields (date, money, traded)
+# for each trading day and keeps only the last lookback_period prices of each stock in a ring buffer.
+# 'state' is kept up to date with the state at the end of each bar; a snapshot's state resumes the stream after it.
+def stream_moving_average_signal(bars, signal, lookback_period, investment_fraction, initial_money, state=None):
+    state = {} if state is None else state
+    window = RingBuffer.from_state(state['window']) if 'window' in state else None
+    orders = Orders(**state['orders']) if state.get('orders') is not None else None
+    growth = state.get('growth', 1.0)
+    money = state.get('money', initial_money)
+    row = state.get('row', -1)
+
+    for bar in bars:
+        row += 1
+        if window is None:
+            window = RingBuffer(lookback_period, len(bar.prices))
+
+        # Sell yesterday's purchases at today's close
+        if orders is not None:
+            next_day_return = np.full(len(bar.prices), np.nan)
+            next_day_return[orders.columns] = settle_orders(orders, bar)
+            day_growth, day_traded = compound_sequential_trades(next_day_return[None], ~np.isnan(next_day_return)[None],
+                                                                investment_fraction, 1.0)
+            traded_value = money * day_traded[0]
+            growth *= day_growth[0]
+            money = initial_money * growth
+            yield bar.date, money, traded_value
+
+        # Add today's prices to the rolling windows and buy the signalled stocks that have a full window
+        window.push(np.flatnonzero(bar.valid), bar.prices[bar.valid])
+        with np.errstate(invalid='ignore'):
+            buy_signal = window.full & bar.valid & signal(bar.prices, window.mean())
+        orders = place_orders(np.flatnonzero(buy_signal), bar) if row >= lookback_period else None
+        state.update(window=window.state(), orders=orders and orders._asdict(), growth=growth, money=money, row=row)
+
+
+# Pass the bars through to a stream, copying the stream's state just before the final bar. The final bar is
+# the only one whose delisting flags can change when more data arrives, so an update replays it from this state.
+def snapshot_before_final_bar(bars, state, final_row, start_row, snapshot):
+    for row, bar in enumerate(bars, start=start_row):
+        if row == final_row:
+            snapshot['state'] = copy.deepcopy(state)
+        yield bar
+
+
+# Feed the bars from start_row on to a strategy's stream() and collect the records after 'after_date', with a
+# snapshot to resume from. The snapshot also records the final bar and the stocks whose history ended before it,
+# to tell later whether the data it was taken from was only extended.
+def stream_records(module, price_arrays, params, state=None, start_row=0, after_date=None):
+    dates, prices, valid = price_arrays['dates'], price_arrays['prices'], price_arrays['valid']
+    final_row = len(dates) - 1
+    state = {} if state is None else state
+    snapshot = {}
+    bars = snapshot_before_final_bar(replay_bars(price_arrays, start_row), state, final_row, start_row, snapshot)
+
+    records = []
+    reporter = ProgressReporter(module.strategy_name)
+    for date, money, traded in module.stream(bars, **params, state=state):
+        if after_date is None or date > after_date:
+            records.append((date, money, traded))
+            reporter.update(date, money)
+    count('bars', len(dates) - start_row)
+
+    money_df = pd.DataFrame(records, columns=['Date', 'Money', 'Traded'])
+    money_df['Strategy'] = module.strategy_name
+    last_rows = last_valid_rows(valid)
+    ended = (last_rows >= 0) & (last_rows < final_row)
+    money_df.attrs['snapshot'] = {
+        'state': snapshot.get('state', {}),
+        'header': {'strategy': module.__name__, 'params': params, 'date': str(pd.Timestamp(dates[final_row]).date()),
+                   'row': int(final_row), 'symbols': [str(symbol) for symbol in price_arrays['symbols']]},
+        'final_bar': {'prices': np.array(prices[final_row]), 'valid': np.array(valid[final_row]), 'ended': ended},
+    }
+    return money_df
+
+
+# Run a strategy module's stream() over the price store and collect its money curve, or only continue its
+# latest snapshot when 'incremental' (see update). The curve carries a snapshot of the stream's state in
+# money_df.attrs['snapshot'], saved with the run by save_streaming_results.
+def run(dataset, strategy='MeanReversion', incremental=False, **params):
+    if incremental:
+        return update(dataset, strategy, **params)
+    module = importlib.import_module(strategy)
+    price_arrays = open_price_arrays(dataset.price_csv_file, cache_dir=dataset.cache_dir, price_dtype=dataset.price_dtype)
+    return stream_records(module, price_arrays, stream_parameters(module, **params))
+
+
+# Parameters of a strategy's stream(), with the given overrides; 'state' is not a parameter of the run
+def stream_parameters(module, **overrides):
+    params = run_parameters(module.stream, **overrides)
+    params.pop('state', None)
+    return params
+
+
+# Why a snapshot cannot resume on the current data, or None if it can: the data must extend the data the
+# snapshot was taken from, with the same stocks, the same final bar and no new rows for stocks that had ended.
+# Only the final bar and the new dates are read, so the check costs O(symbols) per date.
+def stale_reason(header, final_bar, price_arrays):
+    dates = pd.DatetimeIndex(price_arrays['dates'])
+    if [str(symbol) for symbol in price_arrays['symbols']] != header['symbols']:
+        return "the stock universe changed"
+    row = dates.searchsorted(pd.Timestamp(header['date']))
+    if row != header['row'] or row >= len(dates) or dates[row] != pd.Timestamp(header['date']):
+        return "the dates before the snapshot changed"
+    if not (np.array_equal(price_arrays['valid'][row], final_bar['valid'])
+            and np.array_equal(price_arrays['prices'][row], final_bar['prices'], equal_nan=True)):
+        return f"the prices on {header['date']} were revised"
+    if np.asarray(price_arrays['valid'][row + 1:])[:, final_bar['ended']].any():
+        return "a stock whose history had ended has new rows"
+    return None
+
+
+# The latest run of a strategy, made with the given parameters, that has a snapshot
+def latest_snapshot_run(module, params):
+    runs = list_runs([module.strategy_name])
+    for run_id in reversed(runs['run_id'].tolist()):
+        path = state_path(run_id, module.strategy_name)
+        if os.path.isfile(path) and read_header(path)['params'] == json.loads(json.dumps(params, default=str)):
+            return run_id, path
+    return None, None
+
+
+# Continue a strategy's latest snapshot over the dates added since, processing only those dates (plus the
+# snapshot's final bar, replayed from the state before it). Falls back to a full run when there is no usable
+# snapshot. The curve holds only the new dates; save_streaming_results appends it to the snapshot's run.
+def update(dataset, strategy='MeanReversion', **params):
+    module = importlib.import_module(strategy)
+    params = stream_parameters(module, **params)
+    price_arrays = open_price_arrays(dataset.price_csv_file, cache_dir=dataset.cache_dir, price_dtype=dataset.price_dtype)
+
+    base_run_id, path = latest_snapshot_run(module, params)
+    if base_run_id is None:
+        print(f"No snapshot of {module.strategy_name} with these parameters; running the full history.")
+        return stream_records(module, price_arrays, params)
+
+    try:
+        state, header = load_snapshot(path)
+        final_bar = {'prices': state['final_prices'], 'valid': state['final_valid'], 'ended': state['ended']}
+    except (StateError, KeyError, ValueError) as e:
+        print(f"Snapshot of run {base_run_id} is unusable ({e}); running the full history.")
+        return stream_records(module, price_arrays, params)
+
+    reason = stale_reason(header, final_bar, price_arrays)
+    if reason is not None:
+        print(f"Snapshot of run {base_run_id} cannot be continued: {reason}; running the full history.")
+        return stream_records(module, price_arrays, params)
+
+    money_df = stream_records(module, price_arrays, params, state.get('stream'), header['row'], pd.Timestamp(header['date']))
+    money_df.attrs['base_run_id'] = base_run_id
+    print(f"Updated {module.strategy_name} from run {base_run_id} with {len(money_df)} new dates.")
+    return money_df
+
+
+# Save a streaming curve as a run, appended to the run it continues when it comes from update(), with its snapshot
+def save_streaming_results(money_df, strategy, params):
+    module = importlib.import_module(strategy)
+    base_run_id = money_df.attrs.get('base_run_id')
+    params = {**params, 'mode': 'streaming', **({'updated_from': base_run_id} if base_run_id else {})}
+    run_id = save_strategy_results(money_df, module.strategy_name, params, base_run_id=base_run_id)
+
+    snapshot = money_df.attrs['snapshot']
+    final_bar = snapshot['final_bar']
+    save_snapshot(state_path(run_id, module.strategy_name),
+                  {'stream': snapshot['state'], 'final_prices': final_bar['prices'], 'final_valid': final_bar['valid'],
+                   'ended': final_bar['ended']}, snapshot['header'])
+    return run_id
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a strategy as a streaming backtest, one date at a time.")
+    parser.add_argument('strategy', help="Strategy module, e.g. MeanReversion, Reversal, WorstPerDaySim or BuyAndHold")
+    parser.add_argument('--update', action='store_true',
+                        help="Continue the latest snapshot of the strategy over the new dates instead of replaying the full history")
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.strategy)
+    money_df = run(Dataset(), args.strategy, incremental=args.update)
+    run_id = save_streaming_results(money_df, args.strategy, stream_parameters(module))
+    print(f"Streaming {module.strategy_name} results saved as run {run_id}.")
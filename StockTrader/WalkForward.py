@@ -0,0 +1,209 @@
+import argparse
+import importlib
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from PriceData import Dataset
+from Analytics import CurveMatrix, curve_metrics
+from ParameterSweep import expand_grid, parse_grid_argument, plan_tasks
+from ResultsStore import run_parameters, save_strategy_results
+
+# Walk-forward optimization: the history is cut into train/test windows; in each train window the parameters
+# with the best metric are picked and applied to the test window that follows it, and the test segments are
+# chained into one out-of-sample money curve.
+# Every strategy's signals on a date depend only on the prices up to that date, so each combination of the
+# grid is run once over the whole history and every window is a slice of its curve: the rolling indicators
+# of a lookback are computed once (Dataset.indicators) and shared by all the windows instead of being warmed
+# up again for each fold.
+
+train_days = 756  # Trading days in a train window (about three years)
+test_days = 252  # Trading days in a test window; the windows move forward by this much
+metric = 'Sharpe Ratio'  # Column of Analytics.curve_metrics the parameters are picked by
+lower_is_better = ['Annualized Volatility', 'Max Drawdown Duration', 'Turnover']
+
+# Grids used when none is given
+default_grids = {
+    'MeanReversion': {'lookback_period': [20, 50, 100], 'deviation_threshold': [0.03, 0.05, 0.08]},
+    'Reversal': {'lookback_period': [10, 20, 50], 'reversal_threshold': [0.03, 0.05, 0.08]},
+    'WorstPerDaySim': {'num_stocks': [5, 10, 20], 'selection': ['worst', 'best']},
+}
+
+
+# (train_start, test_start, test_end) rows of every fold over 'days' rows. Rolling windows keep train_days
+# rows; anchored windows all start at the first row and grow. The last test window may be shorter.
+def fold_windows(days, train_days=train_days, test_days=test_days, anchored=False):
+    if days <= train_days:
+        raise ValueError(f"A history of {days} days is too short for a train window of {train_days} days.")
+    return [(0 if anchored else test_start - train_days, test_start, min(test_start + test_days, days))
+            for test_start in range(train_days, days, test_days)]
+
+
+# Full-history money curves of one strategy for several parameter combinations, as (dates, money, traded)
+def strategy_curves(module_name, combinations, dataset):
+    strategy = importlib.import_module(module_name)
+    curves = []
+    for params in combinations:
+        money_df = strategy.run(dataset, **params)
+        curves.append((money_df['Date'].to_numpy(), money_df['Money'].to_numpy(), money_df['Traded'].to_numpy()))
+    return curves
+
+
+# Curves on their common dates, as dates x combinations matrices. Before a curve starts (its warm-up)
+# the money is still the initial money and nothing is traded.
+def align_curves(curves, initial_money):
+    dates = pd.DatetimeIndex(np.unique(np.concatenate([curve_dates for curve_dates, _, _ in curves])))
+    money = np.empty((len(dates), len(curves)))
+    traded = np.empty((len(dates), len(curves)))
+    for column, (curve_dates, curve_money, curve_traded) in enumerate(curves):
+        rows = dates.get_indexer(curve_dates)
+        filled = np.full(len(dates), np.nan)
+        filled[rows] = curve_money
+        money[:, column] = pd.Series(filled).ffill().fillna(initial_money[column]).to_numpy()
+        traded[:, column] = 0.0
+        traded[rows, column] = curve_traded
+    return dates, money, traded
+
+
+# Metric of every combination over rows 'start' to 'end' of the aligned curves. The row before 'start'
+# is included as the base, so the first day's return counts.
+def window_metrics(dates, money, traded, start, end, metric=metric):
+    rows = slice(max(start - 1, 0), end)
+    names = np.arange(money.shape[1])
+    counts = np.full(money.shape[1], rows.stop - rows.start)
+    window_dates = np.broadcast_to(dates[rows].to_numpy()[:, None], (rows.stop - rows.start, money.shape[1]))
+    curves = CurveMatrix(names, window_dates, money[rows], traded[rows], counts)
+    return curve_metrics(curves)[metric].to_numpy()
+
+
+# Index of the best combination; NaN metrics (no trades, no volatility) count as the worst
+def best_combination(scores, metric=metric):
+    scores = -scores if metric in lower_is_better else scores
+    return int(np.argmax(np.where(np.isnan(scores), -np.inf, scores)))
+
+
+# Pick the parameters of one fold on its train window and measure them on its test window
+def evaluate_fold(dates, money, traded, window, metric=metric):
+    train_start, test_start, test_end = window
+    train_scores = window_metrics(dates, money, traded, train_start, test_start, metric)
+    choice = best_combination(train_scores, metric)
+    test_score = window_metrics(dates, money[:, [choice]], traded[:, [choice]], test_start, test_end, metric)[0]
+    return choice, train_scores[choice], test_score
+
+
+# Chain the test segments of the chosen combinations into one curve starting at initial_money. Each segment
+# is rescaled to the money the previous one ended with, and so is the money put into its trades.
+def stitch_test_segments(dates, money, traded, windows, choices, initial_money):
+    level = initial_money
+    segments = []
+    for (_, test_start, test_end), choice in zip(windows, choices):
+        scale = level / money[test_start - 1, choice]
+        segment_money = money[test_start:test_end, choice] * scale
+        segments.append(pd.DataFrame({'Date': dates[test_start:test_end], 'Money': segment_money,
+                                      'Traded': traded[test_start:test_end, choice] * scale}))
+        level = segment_money[-1]
+    return pd.concat(segments, ignore_index=True)
+
+
+worker_dataset = None
+
+
+def init_worker(price_csv_file, returns_csv_file, cache_dir, price_dtype):
+    global worker_dataset
+    worker_dataset = Dataset(price_csv_file, returns_csv_file, cache_dir, price_dtype)
+
+
+def curves_in_worker(module_name, combinations):
+    return strategy_curves(module_name, combinations, worker_dataset)
+
+
+# The rows of the aligned curves a fold reads, from the base row before its train window to the end of its
+# test window, and the window counted from the first of them
+def fold_rows(dates, money, traded, window):
+    first = max(window[0] - 1, 0)
+    return dates[first:window[2]], money[first:window[2]], traded[first:window[2]], tuple(row - first for row in window)
+
+
+# Walk a strategy forward over the history: the grid's curves are computed in parallel, grouped by lookback
+# so each worker computes a lookback's indicators once, then the folds are evaluated in parallel. Saves the
+# out-of-sample curve as the run of '<strategy name>-WalkForward' and the folds to folds_file.
+def run(dataset, strategy='MeanReversion', grid=None, metric=metric, train_days=train_days, test_days=test_days,
+        anchored=False, jobs=os.cpu_count(), folds_file='walk_forward_folds.csv'):
+    module = importlib.import_module(strategy)
+    grid = grid or default_grids.get(strategy, {})
+    combinations = expand_grid(grid)
+    initial_money = [run_parameters(module.run, **params)['initial_money'] for params in combinations]
+
+    start = time.perf_counter()
+    if jobs <= 1:
+        curves = strategy_curves(strategy, combinations, dataset)
+        dates, money, traded = align_curves(curves, initial_money)
+        windows = fold_windows(len(dates), train_days, test_days, anchored)
+        folds = [evaluate_fold(dates, money, traded, window, metric) for window in windows]
+    else:
+        # Make sure the memory-mapped caches are current before the workers open them
+        dataset.panel
+        dataset.returns
+
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                 initargs=(dataset.price_csv_file, dataset.returns_csv_file, dataset.cache_dir,
+                                           dataset.price_dtype)) as executor:
+            tasks = plan_tasks(combinations, jobs)
+            curves = [curve for task_curves in executor.map(curves_in_worker, [strategy] * len(tasks), tasks)
+                      for curve in task_curves]
+            dates, money, traded = align_curves(curves, initial_money)
+            windows = fold_windows(len(dates), train_days, test_days, anchored)
+            # Only the rows a fold reads are sent to its worker
+            folds = list(executor.map(evaluate_fold, *zip(*[fold_rows(dates, money, traded, window) for window in windows]),
+                                      itertools.repeat(metric)))
+    choices = [choice for choice, _, _ in folds]
+
+    # The chained test segments, saved as a run like any strategy's curve
+    out_of_sample = stitch_test_segments(dates, money, traded, windows, choices, initial_money[0])
+    name = f"{module.strategy_name}-WalkForward"
+    run_id = save_strategy_results(out_of_sample, name, {
+        'strategy': strategy, 'grid': grid, 'metric': metric, 'train_days': train_days, 'test_days': test_days,
+        'anchored': anchored, 'mode': 'walk-forward'})
+
+    folds_df = pd.DataFrame([{
+        'Fold': number,
+        'Train Start': dates[train_start].date(), 'Train End': dates[test_start - 1].date(),
+        'Test Start': dates[test_start].date(), 'Test End': dates[test_end - 1].date(),
+        **combinations[choice], f'Train {metric}': train_score, f'Test {metric}': test_score,
+    } for number, ((train_start, test_start, test_end), (choice, train_score, test_score)) in enumerate(zip(windows, folds))])
+    folds_df.to_csv(folds_file, index=False)
+
+    # The out-of-sample metric against the best in-sample one: the combination that, with hindsight, did best
+    # over the same dates
+    first_test = windows[0][1]
+    in_sample = window_metrics(dates, money, traded, first_test, len(dates), metric)
+    best = best_combination(in_sample, metric)
+    stitched_money = np.concatenate([[initial_money[0]], out_of_sample['Money'].to_numpy()])[:, None]
+    stitched_traded = np.concatenate([[0.0], out_of_sample['Traded'].to_numpy()])[:, None]
+    out_of_sample_score = window_metrics(dates[first_test - 1:], stitched_money, stitched_traded,
+                                         1, len(stitched_money), metric)[0]
+
+    print(folds_df.to_string(index=False))
+    print(f"{len(combinations)} combinations, {len(windows)} folds in {time.perf_counter() - start:.1f}s.")
+    print(f"Out-of-sample {metric}: {out_of_sample_score:.3f}; best in-sample {metric} over the same dates: "
+          f"{in_sample[best]:.3f} ({combinations[best]}).")
+    print(f"Out-of-sample curve saved as run {run_id} of {name}, folds saved to '{folds_file}'.")
+    return out_of_sample, folds_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Walk-forward optimization of a strategy's parameters.")
+    parser.add_argument('strategy', help="Strategy module, e.g. MeanReversion, Reversal or WorstPerDaySim")
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help="Values for one parameter; repeat for each parameter in the grid")
+    parser.add_argument('--metric', default=metric, help="Metric the parameters are picked by, e.g. 'Sortino Ratio'")
+    parser.add_argument('--train-days', type=int, default=train_days)
+    parser.add_argument('--test-days', type=int, default=test_days)
+    parser.add_argument('--anchored', action='store_true', help="Grow the train windows from the first date instead of rolling them")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument('--output', default='walk_forward_folds.csv')
+    args = parser.parse_args()
+    run(Dataset(), args.strategy, dict(parse_grid_argument(text) for text in args.grid), args.metric,
+        args.train_days, args.test_days, args.anchored, args.jobs, args.output)
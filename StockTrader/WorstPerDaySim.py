@@ -1,98 +1,80 @@
-import pandas as pd
-import os
-
-# Load the daily returns data
-daily_returns = pd.read_csv('djia_daily_returns.csv')
-daily_returns['Date'] = pd.to_datetime(daily_returns['Date']).dt.date  # Ensure 'Date' is in datetime format
-
-# Load the original stock data with adjusted close prices
-stock_data = pd.read_csv('djia_all_data.csv')
-stock_data['Date'] = pd.to_datetime(stock_data['Date']).dt.date # Ensure 'Date' is in datetime format
-
-# Set the initial amount of money
+import numpy as np
+from PriceData import Dataset
+from Ranking import bottom_k, top_k
+from Simulation import compound_fixed_stake_trades
+from Strategy import Strategy, param, returns
+from Streaming import DailyReturns, Orders, place_orders, settle_orders
+from ResultsStore import run_parameters, save_strategy_results
+
+strategy_name = 'WorstPerDay'
+
+# Set parameters for the strategy
+num_stocks = 10  # Number of worst performers bought each day
+investment_fraction = 0.10  # Fraction of the day's starting money put into each stock
+selection = 'worst'  # 'worst' buys the day's biggest losers; 'best' buys its biggest winners (momentum)
 initial_money = 100000
-current_money = initial_money
-
-# To store the money over time for the trading strategy
-money_over_time = []
-
-# Get a list of all unique dates
-all_dates = sorted(daily_returns['Date'].unique())
-
-# Simulate the trading strategy over the entire period
-for i in range(len(all_dates) - 1):
-    current_date = all_dates[i]
-    next_date = all_dates[i + 1]
-
-    # Find the 10 worst performing stocks on the current date
-    daily_data = daily_returns[daily_returns['Date'] == current_date]
-    worst_stocks = daily_data.nsmallest(10, 'Daily Return')
-
-    # Calculate 5% of the current money for each stock
-    investment_per_stock = 0.10 * current_money
-
-    # Track total investment for the day
-    total_investment = 0
-
-    for _, stock in worst_stocks.iterrows():
-        symbol = stock['Symbol']
-
-        # Get the closing price of the current day
-        current_day_price = stock_data[(stock_data['Date'] == current_date) & (stock_data['Symbol'] == symbol)]['Adj Close'].values
-        if current_day_price.size == 0:
-            print(f"Missing price data for {symbol} on {current_date}. Skipping trade.")
-            continue
-
-        current_day_price = current_day_price[0]
-
-        # Check if there's enough money to invest
-        if current_money < investment_per_stock:
-            print(f"Not enough money to invest in {symbol} on {current_date}. Skipping trade.")
-            continue
-
-        # Calculate the number of shares to buy
-        num_shares = investment_per_stock / current_day_price
-
-        # Get the closing price of the next day
-        next_day_price = stock_data[(stock_data['Date'] == next_date) & (stock_data['Symbol'] == symbol)]['Adj Close'].values
-        if next_day_price.size == 0:
-            print(f"Missing price data for {symbol} on {next_date}. Skipping sale.")
-            continue
-
-        next_day_price = next_day_price[0]
-
-        # Calculate the money after selling at next day's price
-        sale_amount = num_shares * next_day_price
-        profit_loss = sale_amount - investment_per_stock
-
-        # Update the current money
-        current_money += profit_loss
-        total_investment += investment_per_stock
-
-    # Record the current money and date
-    money_over_time.append({'Date': next_date, 'Money': current_money, 'Strategy': 'WorstPerDay'})
-
-    # Print the money after each day's trading
-    print(f"Date: {next_date.strftime('%Y-%m-%d')}, Money: ${current_money:,.2f}")
-
-# Create a DataFrame to store the new Trading strategy results
-money_df = pd.DataFrame(money_over_time)
-
-# Check if the shared CSV file exists
-csv_file = 'strategy_comparison.csv'
-if os.path.isfile(csv_file):
-    # Load the existing CSV file
-    existing_data = pd.read_csv(csv_file)
-
-    # Remove any previous Trading strategy data
-    existing_data = existing_data[existing_data['Strategy'] != 'WorstPerDay']
-
-    # Append the new Trading strategy data to the existing data
-    combined_data = pd.concat([existing_data, money_df], ignore_index=True)
-else:
-    # If no file exists, use only the new Trading strategy data
-    combined_data = money_df
 
-# Save the updated data to the CSV file, overwriting only the relevant strategy section
-combined_data.to_csv(csv_file, index=False)
-print("Trading strategy results updated in 'strategy_comparison.csv'.")
+# Ranking used for each selection rule, and the order it ranks the day's returns in
+rankings = {'worst': bottom_k, 'best': top_k}
+rank_orders = {'worst': 'lowest', 'best': 'highest'}
+
+
+# Buy, at the close, the num_stocks stocks with the lowest (or highest) return of the day, in rank order, and
+# sell them at the next day's close. Every stock of a day gets investment_fraction of that day's starting
+# money, and a trade is skipped if there isn't enough money left for it.
+class WorstPerDayStrategy(Strategy):
+    name = strategy_name
+    rank_by = returns(1)
+    max_positions = param('num_stocks')
+    sizing = 'fixed_stake'
+    investment_fraction = param('investment_fraction')
+    holding_period = 1
+
+
+def run(dataset, num_stocks=num_stocks, investment_fraction=investment_fraction, selection=selection,
+        initial_money=initial_money):
+    if selection not in rank_orders:
+        raise ValueError(f"Unknown selection '{selection}'; use one of {', '.join(rank_orders)}.")
+    return WorstPerDayStrategy(rank=rank_orders[selection]).run(dataset, num_stocks=num_stocks, investment_fraction=investment_fraction,
+                                                                initial_money=initial_money)
+
+
+# Streaming version of run(): takes the bars one date at a time and yields (date, money, traded) for each
+# trading day, keeping only each stock's last price and the stocks bought on the previous day.
+# 'state' is kept up to date with the state at the end of each bar; a snapshot's state resumes the stream after it.
+def stream(bars, num_stocks=num_stocks, investment_fraction=investment_fraction, selection=selection,
+           initial_money=initial_money, state=None):
+    state = {} if state is None else state
+    daily_returns = DailyReturns.from_state(state['daily_returns']) if 'daily_returns' in state else None
+    orders = Orders(**state['orders']) if state.get('orders') is not None else None
+    growth = state.get('growth', 1.0)
+    money = state.get('money', initial_money)
+
+    for bar in bars:
+        if daily_returns is None:
+            daily_returns = DailyReturns(len(bar.prices))
+
+        # Sell yesterday's picks at today's close; every pick gets the same share of yesterday's money
+        if orders is not None:
+            next_day_return = settle_orders(orders, bar)
+            day_growth, day_traded = compound_fixed_stake_trades(next_day_return[None], ~np.isnan(next_day_return)[None],
+                                                                 investment_fraction, 1.0)
+            traded_value = money * day_traded[0]
+            growth *= day_growth[0]
+            money = initial_money * growth
+            yield bar.date, money, traded_value
+
+        # Rank today's returns and buy the picks at today's close
+        current_returns = daily_returns.update(bar)
+        has_return = ~np.isnan(current_returns)
+        orders = None
+        if has_return.any():
+            picked_stocks = rankings[selection](current_returns[None], has_return[None], num_stocks)[0]
+            orders = place_orders(picked_stocks, bar)
+        state.update(daily_returns=daily_returns.state(), orders=orders and orders._asdict(), growth=growth, money=money)
+
+
+if __name__ == '__main__':
+    money_df = run(Dataset())
+    run_id = save_strategy_results(money_df, strategy_name, run_parameters(run))
+    print(f"Trading strategy results saved as run {run_id}.")
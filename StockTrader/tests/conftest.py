@@ -0,0 +1,18 @@
+import os
+import sys
+import pytest
+
+# The modules live next to this directory and import each other by name, as they do when run from StockTrader/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Benchmark import write_synthetic_data
+from PriceData import Dataset
+
+
+# A small seeded universe with ragged histories (listings, delistings and missing rows), written in the
+# djia_all_data.csv layout to a temporary directory that the test runs in, so its caches and results stay there
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_synthetic_data('djia_all_data.csv', num_symbols=12, num_days=400, missing_rate=0.02, seed=3)
+    return Dataset()
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+import pytest
+from Indicators import RunningSums
+
+
+@pytest.mark.parametrize('lookback_period', [1, 5, 20])
+def test_running_sums_match_pandas_rolling(dataset, lookback_period):
+    panel = dataset.panel
+    prices = np.array(panel.prices, dtype=float)
+    indicators = RunningSums(prices, panel.valid).window(lookback_period)
+
+    # Windows are over each symbol's own rows and only defined once it has lookback_period of them
+    for column in range(prices.shape[1]):
+        rows = np.flatnonzero(panel.valid[:, column])
+        own_rows = pd.Series(prices[rows, column])
+        rolling = own_rows.rolling(lookback_period, min_periods=1)
+        ready = np.arange(1, len(rows) + 1) >= lookback_period
+        np.testing.assert_allclose(indicators.mean[rows, column], np.where(ready, rolling.mean(), np.nan),
+                                   rtol=1e-10, equal_nan=True)
+        np.testing.assert_allclose(indicators.std[rows, column], np.where(ready, rolling.std(), np.nan),
+                                   rtol=1e-7, atol=1e-9, equal_nan=True)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from Ranking import bottom_k, top_k
+
+
+# Rounded values give plenty of ties; missing and NaN entries are never ranked
+def random_keys(seed, rows=300, columns=25):
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.normal(0, 1, (rows, columns)), 1)
+    values[rng.random((rows, columns)) < 0.1] = np.nan
+    valid = rng.random((rows, columns)) >= 0.2
+    return values, valid
+
+
+# Full stable sort of each row, ties in column order, padded with -1
+def sorted_picks(values, valid, k, descending=False):
+    width = min(k, values.shape[1])
+    picks = np.full((len(values), width), -1)
+    for row in range(len(values)):
+        columns = np.flatnonzero(valid[row] & ~np.isnan(values[row]))
+        keys = -values[row, columns] if descending else values[row, columns]
+        ranked = columns[np.argsort(keys, kind='stable')][:width]
+        picks[row, :len(ranked)] = ranked
+    return picks
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('k', [1, 5, 25, 40])
+def test_bottom_k_matches_sort(seed, k):
+    values, valid = random_keys(seed)
+    np.testing.assert_array_equal(bottom_k(values, valid, k), sorted_picks(values, valid, k))
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('k', [1, 5, 25, 40])
+def test_top_k_matches_sort(seed, k):
+    values, valid = random_keys(seed)
+    np.testing.assert_array_equal(top_k(values, valid, k), sorted_picks(values, valid, k, descending=True))
+
+
+def test_huge_k_is_capped_at_the_columns():
+    values, valid = random_keys(0, rows=4, columns=6)
+    assert bottom_k(values, valid, 10 ** 12).shape == (4, 6)
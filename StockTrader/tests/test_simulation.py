@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from Simulation import compound_fixed_stake_trades, compound_sequential_trades
+
+
+def random_trades(seed, days=200, slots=8, scale=0.05):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0, scale, (days, slots))
+    traded = rng.random((days, slots)) < 0.6
+    returns[~traded & (rng.random((days, slots)) < 0.5)] = np.nan
+    return returns, traded
+
+
+# Trade by trade, in slot order, as the strategies used to
+def naive_sequential(returns, traded, investment_fraction, initial_money):
+    money, curve, traded_values = initial_money, [], []
+    for day in range(len(returns)):
+        traded_value = 0.0
+        for slot in np.flatnonzero(traded[day]):
+            stake = money * investment_fraction
+            traded_value += stake
+            money += stake * returns[day, slot]
+        curve.append(money)
+        traded_values.append(traded_value)
+    return np.array(curve), np.array(traded_values)
+
+
+def naive_fixed_stake(returns, traded, investment_fraction, initial_money):
+    money, curve, traded_values = initial_money, [], []
+    for day in range(len(returns)):
+        stake = money * investment_fraction
+        traded_value = 0.0
+        for slot in np.flatnonzero(traded[day]):
+            if money < stake:
+                continue
+            traded_value += stake
+            money += stake * returns[day, slot]
+        curve.append(money)
+        traded_values.append(traded_value)
+    return np.array(curve), np.array(traded_values)
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('investment_fraction', [0.1, 0.5])
+def test_compound_sequential_matches_loop(seed, investment_fraction):
+    returns, traded = random_trades(seed)
+    money, traded_value = compound_sequential_trades(returns, traded, investment_fraction, 100000)
+    expected_money, expected_traded = naive_sequential(returns, traded, investment_fraction, 100000)
+    np.testing.assert_allclose(money, expected_money, rtol=1e-10)
+    np.testing.assert_allclose(traded_value, expected_traded, rtol=1e-10)
+
+
+# Large stakes and big losses make the money fall below the stake inside a day, so trades get skipped
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('investment_fraction, scale', [(0.1, 0.05), (0.4, 0.8)])
+def test_compound_fixed_stake_matches_loop(seed, investment_fraction, scale):
+    returns, traded = random_trades(seed, scale=scale)
+    returns = np.maximum(returns, -1)
+    money, traded_value = compound_fixed_stake_trades(returns, traded, investment_fraction, 100000)
+    expected_money, expected_traded = naive_fixed_stake(returns, traded, investment_fraction, 100000)
+    np.testing.assert_allclose(money, expected_money, rtol=1e-10)
+    np.testing.assert_allclose(traded_value, expected_traded, rtol=1e-10)
@@ -0,0 +1,50 @@
+import importlib
+import numpy as np
+import pandas as pd
+import pytest
+import Streaming
+from Benchmark import write_synthetic_data
+from PriceData import Dataset
+from ResultsStore import load_runs
+
+strategy_modules = ['WorstPerDaySim', 'BuyAndHold', 'MeanReversion', 'Reversal']
+
+
+def assert_same_curve(streamed, batch):
+    np.testing.assert_array_equal(streamed['Date'].to_numpy(), batch['Date'].to_numpy())
+    np.testing.assert_allclose(streamed['Money'].to_numpy(), batch['Money'].to_numpy(), rtol=1e-12)
+    np.testing.assert_allclose(streamed['Traded'].to_numpy(), batch['Traded'].to_numpy(), rtol=1e-12, atol=1e-6)
+
+
+@pytest.mark.parametrize('strategy', strategy_modules)
+def test_streaming_matches_batch(dataset, strategy):
+    batch = importlib.import_module(strategy).run(dataset)
+    assert len(batch) > 0
+    assert_same_curve(Streaming.run(dataset, strategy), batch)
+
+
+def test_stream_uses_the_strategy_investment_fraction(dataset, monkeypatch):
+    import Reversal
+    monkeypatch.setattr(Reversal.ReversalStrategy, 'investment_fraction', 0.25)
+    assert_same_curve(Streaming.run(dataset, 'Reversal'), Reversal.run(dataset))
+
+
+# A snapshot taken on part of the history, continued with --update once the rest arrives, gives the same
+# curve as streaming the whole history
+@pytest.mark.parametrize('strategy', strategy_modules)
+def test_update_matches_full_run(dataset, strategy):
+    full = Streaming.run(dataset, strategy)
+    full_data = pd.read_csv(dataset.price_csv_file, float_precision='round_trip')
+
+    full_data[pd.to_datetime(full_data['Date']) < full['Date'].iloc[len(full) * 2 // 3]].to_csv(
+        dataset.price_csv_file, index=False)
+    params = Streaming.stream_parameters(importlib.import_module(strategy))
+    Streaming.save_streaming_results(Streaming.run(Dataset(), strategy), strategy, params)
+
+    write_synthetic_data(dataset.price_csv_file, num_symbols=12, num_days=400, missing_rate=0.02, seed=3)
+    update = Streaming.run(Dataset(), strategy, incremental=True)
+    assert 'base_run_id' in update.attrs
+    assert len(update) < len(full)
+    run_id = Streaming.save_streaming_results(update, strategy, params)
+
+    assert_same_curve(load_runs([run_id]), full)